@@ -2,15 +2,25 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox
+import importlib
 import threading
-from tkcalendar import DateEntry
-from datetime import datetime, timedelta
-import calendar
 import time
-from pathlib import Path
+from collections import deque
+from tkcalendar import DateEntry
+from datetime import datetime
 from config import BASES_CONFIG
-from iiko_collector import IikoDataCollector
-from report_generator import ReportGenerator
+from instrumentation import run_metrics
+from olap_cache import OPEN_DAY_TTL
+from periods import PERIOD_PRESETS, period_dates
+from report_job import ReportJob, JobCancelled
+
+LOG_FLUSH_MS = 100     # период переноса записей лога в виджет
+LOG_MAX_LINES = 2000   # строк, которые хранит виджет лога
+PROGRESS_UPDATE_MS = 250
+# модули с pandas, openpyxl и requests: импортируются не при запуске,
+# а в фоне после показа окна (и при первой выгрузке, если фон не успел)
+WARMUP_MODULES = ("report_generator", "data_fetcher", "incremental_report", "report_preview")
+SESSION_CACHE_SIZE = 4  # наборов загруженных данных (базы и период), которые хранятся до закрытия программы
 
 class IikoReportApp:
     def __init__(self, root):
@@ -24,9 +34,38 @@ class IikoReportApp:
         self.selected_sheets = []
         self.start_date = None
         self.end_date = None
+        self.refresh_cache = False
+        self.job = None
+        self.warmup_time = None
+        # загруженные в этом сеансе данные: (базы, начало, конец) -> OlapFrame
+        self.session_data = {}
+
+        # кольцевой буфер записей лога: рабочие потоки пишут без блокировок,
+        # при переполнении отбрасываются самые старые записи
+        self.log_queue = deque(maxlen=LOG_MAX_LINES)
 
         self.create_log_widget()
         self.create_widgets()
+        self.root.after(LOG_FLUSH_MS, self.drain_log_queue)
+        self.root.after_idle(self.warm_up)
+
+    def warm_up(self):
+        """Фоновый импорт модулей отчета, когда окно уже показано.
+
+        Импорт в Python защищен блокировкой модуля, поэтому выгрузка,
+        запущенная раньше окончания прогрева, просто дождется его.
+        """
+        def run():
+            started = time.perf_counter()
+            try:
+                for name in WARMUP_MODULES:
+                    importlib.import_module(name)
+            except Exception as e:
+                self.log_message(f"⚠️ Не удалось загрузить модули отчета: {str(e)}")
+            finally:
+                self.warmup_time = time.perf_counter() - started
+
+        threading.Thread(target=run, daemon=True).start()
 
     def create_log_widget(self):
         log_frame = ttk.LabelFrame(self.root, text="Лог выполнения", padding="10")
@@ -43,13 +82,30 @@ class IikoReportApp:
         self.root.rowconfigure(1, weight=1)
 
     def log_message(self, message):
+        """Добавление записи в лог. Можно вызывать из любого потока: запись
+        только кладется в очередь, виджет обновляет главный цикл Tk."""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        if hasattr(self, 'log_text'):
-            self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        self.log_queue.append(f"[{timestamp}] {message}")
+
+    def drain_log_queue(self):
+        """Перенос накопленных записей в виджет одной вставкой (по таймеру root.after)"""
+        lines = []
+        while True:
+            try:
+                lines.append(self.log_queue.popleft())
+            except IndexError:
+                break
+        if lines:
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                self.log_text.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
             self.log_text.see(tk.END)
-            self.root.update_idletasks()
-        else:
-            print(f"[{timestamp}] {message}")
+        self.root.after(LOG_FLUSH_MS, self.drain_log_queue)
+
+    def show_message(self, show, title, message):
+        """Показ messagebox из рабочего потока через главный цикл Tk"""
+        self.root.after(0, lambda: show(title, message))
 
     def create_widgets(self):
         main_frame = ttk.Frame(self.root, padding="10")
@@ -129,8 +185,7 @@ class IikoReportApp:
         ttk.Label(period_frame, text="Период:").grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
         self.period_var = tk.StringVar(value="Текущий месяц")
         period_combo = ttk.Combobox(period_frame, textvariable=self.period_var,
-                                   values=["Сегодня", "Вчера", "Текущая неделя", "Прошлая неделя", "Текущий месяц",
-                                          "Прошлый месяц", "Текущий год", "Прошлый год", "Другой..."])
+                                   values=PERIOD_PRESETS)
         period_combo.grid(row=0, column=1, sticky=tk.W, padx=(0, 10))
         period_combo.bind('<<ComboboxSelected>>', self.on_period_change)
 
@@ -142,6 +197,16 @@ class IikoReportApp:
         self.end_calendar = DateEntry(period_frame, width=12, background='darkblue', foreground='white', borderwidth=2, date_pattern='dd.mm.yyyy')
         self.end_calendar.grid(row=1, column=3, sticky=tk.W)
 
+        self.refresh_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(period_frame, text="Обновить кэш (загрузить все дни заново)",
+                        variable=self.refresh_cache_var).grid(row=2, column=0, columnspan=4, sticky=tk.W, pady=(5, 0))
+        ttk.Label(period_frame, foreground="gray",
+                  text=f"Без этой отметки текущий день берется из кэша, если загружен не больше "
+                       f"{OPEN_DAY_TTL // 60} мин назад").grid(row=3, column=0, columnspan=4, sticky=tk.W, padx=(20, 0))
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(period_frame, text="Дополнить последний отчет за этот период",
+                        variable=self.incremental_var).grid(row=4, column=0, columnspan=4, sticky=tk.W)
+
         self.setup_calendars()
 
         # Кнопка и прогресс
@@ -152,8 +217,18 @@ class IikoReportApp:
         self.run_button = ttk.Button(button_frame, text="Запустить выгрузку", command=self.start_report_generation)
         self.run_button.grid(row=0, column=0, pady=5, sticky=(tk.W, tk.E))
 
-        self.progress = ttk.Progressbar(button_frame, mode='indeterminate')
-        self.progress.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
+        self.preview_button = ttk.Button(button_frame, text="Предпросмотр",
+                                         command=lambda: self.start_report_generation(preview=True))
+        self.preview_button.grid(row=0, column=1, pady=5, padx=(5, 0))
+
+        self.cancel_button = ttk.Button(button_frame, text="Отменить", command=self.cancel_report_generation, state='disabled')
+        self.cancel_button.grid(row=0, column=2, pady=5, padx=(5, 0))
+
+        self.progress = ttk.Progressbar(button_frame, mode='determinate', maximum=100)
+        self.progress.grid(row=1, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(5, 0))
+
+        self.progress_var = tk.StringVar(value="")
+        ttk.Label(button_frame, textvariable=self.progress_var).grid(row=2, column=0, columnspan=3, sticky=tk.W)
 
         # Лог (уже создан)
         log_frame = self.log_text.master
@@ -171,48 +246,8 @@ class IikoReportApp:
         self.on_period_change()
 
     def on_period_change(self, event=None):
-        period = self.period_var.get()
-        today = datetime.now()
-
-        if period == "Сегодня":
-            self.start_calendar.set_date(today)
-            self.end_calendar.set_date(today)
-        elif period == "Вчера":
-            yesterday = today - timedelta(days=1)
-            self.start_calendar.set_date(yesterday)
-            self.end_calendar.set_date(yesterday)
-        elif period == "Текущая неделя":
-            start = today - timedelta(days=today.weekday())
-            end = start + timedelta(days=6)
-            self.start_calendar.set_date(start)
-            self.end_calendar.set_date(end)
-        elif period == "Прошлая неделя":
-            start = today - timedelta(days=today.weekday() + 7)
-            end = start + timedelta(days=6)
-            self.start_calendar.set_date(start)
-            self.end_calendar.set_date(end)
-        elif period == "Текущий месяц":
-            start = today.replace(day=1)
-            end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
-            self.start_calendar.set_date(start)
-            self.end_calendar.set_date(end)
-        elif period == "Прошлый месяц":
-            if today.month == 1:
-                start = today.replace(year=today.year-1, month=12, day=1)
-                end = today.replace(year=today.year-1, month=12, day=31)
-            else:
-                start = today.replace(month=today.month-1, day=1)
-                end = today.replace(month=today.month-1, day=calendar.monthrange(today.year, today.month-1)[1])
-            self.start_calendar.set_date(start)
-            self.end_calendar.set_date(end)
-        elif period == "Текущий год":
-            start = today.replace(month=1, day=1)
-            end = today.replace(month=12, day=31)
-            self.start_calendar.set_date(start)
-            self.end_calendar.set_date(end)
-        elif period == "Прошлый год":
-            start = today.replace(year=today.year-1, month=1, day=1)
-            end = today.replace(year=today.year-1, month=12, day=31)
+        start, end = period_dates(self.period_var.get())
+        if start is not None:
             self.start_calendar.set_date(start)
             self.end_calendar.set_date(end)
 
@@ -250,7 +285,7 @@ class IikoReportApp:
             messagebox.showerror("Ошибка", f"Неверно выбран период: {str(e)}")
             return None, None
 
-    def start_report_generation(self):
+    def start_report_generation(self, preview=False):
         self.selected_bases = self.get_selected_bases()
         if not self.selected_bases:
             messagebox.showerror("Ошибка", "Выберите хотя бы одну базу")
@@ -264,65 +299,196 @@ class IikoReportApp:
         self.start_date, self.end_date = self.get_start_end_dates()
         if self.start_date is None or self.end_date is None:
             return
+        self.refresh_cache = self.refresh_cache_var.get()
+        self.incremental = self.incremental_var.get()
 
+        self.job = ReportJob()
         self.run_button.config(state='disabled')
-        self.progress.start()
+        self.preview_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        self.progress['value'] = 0
+        self.update_progress()
 
-        thread = threading.Thread(target=self.generate_report, daemon=True)
+        target = self.generate_preview if preview else self.generate_report
+        thread = threading.Thread(target=target, args=(self.job,), daemon=True)
         thread.start()
 
-    def generate_report(self):
+    def cancel_report_generation(self):
+        if self.job is not None:
+            self.log_message("⛔ Отмена выгрузки...")
+            self.cancel_button.config(state='disabled')
+            self.job.cancel()
+
+    def update_progress(self):
+        """Обновление полосы прогресса и строки состояния по снимку задачи"""
+        if self.job is None:
+            return
+        state = self.job.snapshot()
+        if state['total']:
+            self.progress['value'] = state['done'] / state['total'] * 100
+        text = f"Выполнено {state['done']} из {state['total']} • {state['bytes'] / 1024 / 1024:.1f} МБ"
+        if state['eta'] is not None:
+            minutes, seconds = divmod(int(state['eta']), 60)
+            text += f" • осталось ~{minutes}:{seconds:02d}"
+        if state['stage']:
+            text += f" • {state['stage']}"
+        self.progress_var.set(text)
+        self.root.after(PROGRESS_UPDATE_MS, self.update_progress)
+
+    def generate_report(self, job):
+        with run_metrics("gui") as run:
+            self._generate_report(job)
+        self.log_message("=== Время этапов ===\n" + run.format_table())
+
+    def _generate_report(self, job):
+        # импорт здесь, а не в начале модуля: окно открывается без pandas/openpyxl
+        from data_fetcher import fetch_bases, MAX_WORKERS
+        from incremental_report import refresh_report
+        from report_generator import ReportGenerator, default_report_path
+
         try:
+            if self.incremental:
+                job.set_stage("Дополнение отчета")
+                report_path = refresh_report(
+                    self.bases_config, self.selected_bases, self.start_date, self.end_date,
+                    self.selected_sheets, log=self.log_message, job=job,
+                    max_workers=MAX_WORKERS, refresh=self.refresh_cache
+                )
+                if report_path is not None:
+                    self.show_message(messagebox.showinfo, "Успех", f"Отчет успешно дополнен!\n{report_path}")
+                    return
+
             self.log_message("=== Начало получения данных из iiko ===")
-            all_data = []
-            average_data_dict = {}
-
-            for base_name in self.selected_bases:
-                config = self.bases_config[base_name]
-                self.log_message(f"=== Работаем с базой: {base_name} ===")
-                collector = IikoDataCollector(config["url"])
-
-                data = collector.get_report_data(config["preset_id"], self.start_date, self.end_date)
-                if data and 'data' in data:
-                    for item in data['data']:
-                        item['BaseName'] = base_name
-                    all_data.extend(data['data'])
-
-                avg_data = collector.get_report_data(config["preset_id"], self.start_date, self.end_date)
-                if avg_data and 'data' in avg_data:
-                    average_data_dict[base_name] = avg_data['data']
-
-            if all_data:
-                current_date = datetime.now()
-                report_date_str = current_date.strftime("%d_%m_%Y")
-                timestamp = int(time.time())
-                documents_path = Path.home() / "Documents"
-                reports_path = documents_path / "Отчёты iiko"
-                reports_path.mkdir(exist_ok=True)
-                excel_filename = reports_path / f"Свод_План_Факт_{report_date_str}_{timestamp}.xlsx"
-
-                generator = ReportGenerator(log_callback=self.log_message)
+            job.set_stage("Загрузка данных")
+            base_results = []
+            olap_data = fetch_bases(
+                self.bases_config, self.selected_bases, self.start_date, self.end_date,
+                max_workers=MAX_WORKERS, log=self.log_message,
+                refresh=self.refresh_cache, job=job, results=base_results
+            )
+            failed_bases = [result.base_name for result in base_results if result.failed]
+            if not failed_bases:
+                self.remember_session_data(olap_data)
+
+            if not olap_data.empty:
+                excel_filename = default_report_path()
+
+                job.set_stage("Формирование отчета")
+                generator = ReportGenerator(log_callback=self.log_message, job=job)
                 success = generator.create_excel_report(
-                    all_data, self.bases_config, excel_filename,
-                    self.start_date, self.end_date, average_data_dict, self.selected_sheets
+                    olap_data, self.bases_config, excel_filename,
+                    self.start_date, self.end_date, None, self.selected_sheets,
+                    bases=self.selected_bases, failed_bases=failed_bases
                 )
 
                 if success:
                     self.log_message(f"✅ Отчет создан: {excel_filename}")
-                    messagebox.showinfo("Успех", f"Отчет успешно создан!\n{excel_filename}")
+                    if failed_bases:
+                        self.show_message(messagebox.showwarning, "Отчет создан не полностью",
+                                          f"Отчет создан без данных баз: {', '.join(failed_bases)}\n{excel_filename}")
+                    else:
+                        self.show_message(messagebox.showinfo, "Успех", f"Отчет успешно создан!\n{excel_filename}")
                 else:
                     self.log_message("❌ Ошибка при создании отчета")
-                    messagebox.showerror("Ошибка", "Не удалось создать отчет")
+                    self.show_message(messagebox.showerror, "Ошибка", "Не удалось создать отчет")
             else:
                 self.log_message("❌ Нет данных для создания отчета")
-                messagebox.showwarning("Предупреждение", "Нет данных для создания отчета")
+                self.show_message(messagebox.showwarning, "Предупреждение", "Нет данных для создания отчета")
 
+        except JobCancelled:
+            self.log_message("⛔ Выгрузка отменена")
         except Exception as e:
             self.log_message(f"❌ Ошибка: {str(e)}")
-            messagebox.showerror("Ошибка", f"Произошла ошибка: {str(e)}")
+            self.show_message(messagebox.showerror, "Ошибка", f"Произошла ошибка: {str(e)}")
         finally:
             self.root.after(0, self.finish_report_generation)
 
+    def session_key(self):
+        return tuple(self.selected_bases), self.start_date, self.end_date
+
+    def remember_session_data(self, olap_data):
+        """Сохранение загруженных данных для предпросмотра без повторной загрузки"""
+        self.session_data.pop(self.session_key(), None)
+        self.session_data[self.session_key()] = olap_data
+        while len(self.session_data) > SESSION_CACHE_SIZE:
+            self.session_data.pop(next(iter(self.session_data)))
+
+    def generate_preview(self, job):
+        """Расчет таблицы метрик для окна предпросмотра; книга Excel не пишется.
+
+        Данные тех же баз и периода, уже загруженные в этом сеансе, берутся
+        из session_data (если не отмечено обновление кэша).
+        """
+        from data_fetcher import fetch_bases, MAX_WORKERS
+        from report_generator import ReportGenerator
+
+        bases, sheets = list(self.selected_bases), list(self.selected_sheets)
+        start_date, end_date = self.start_date, self.end_date
+        failed_bases = []
+        try:
+            olap_data = None if self.refresh_cache else self.session_data.get(self.session_key())
+            if olap_data is None:
+                job.set_stage("Загрузка данных")
+                base_results = []
+                olap_data = fetch_bases(
+                    self.bases_config, bases, start_date, end_date,
+                    max_workers=MAX_WORKERS, log=self.log_message,
+                    refresh=self.refresh_cache, job=job, results=base_results
+                )
+                failed_bases = [result.base_name for result in base_results if result.failed]
+                if not failed_bases:
+                    self.remember_session_data(olap_data)
+            else:
+                self.log_message("♻️ Данные взяты из загруженных в этом сеансе")
+
+            job.set_stage("Расчет показателей")
+            metrics, cash_registers = ReportGenerator(log_callback=self.log_message, job=job).prepare_report_data(olap_data)
+            if metrics is None:
+                self.log_message("❌ Нет данных для предпросмотра")
+                self.show_message(messagebox.showwarning, "Предупреждение", "Нет данных для предпросмотра")
+                return
+            self.root.after(0, lambda: self.open_preview(metrics, cash_registers, bases, sheets, start_date, end_date,
+                                                         failed_bases))
+
+        except JobCancelled:
+            self.log_message("⛔ Выгрузка отменена")
+        except Exception as e:
+            self.log_message(f"❌ Ошибка: {str(e)}")
+            self.show_message(messagebox.showerror, "Ошибка", f"Произошла ошибка: {str(e)}")
+        finally:
+            self.root.after(0, self.finish_report_generation)
+
+    def open_preview(self, metrics, cash_registers, bases, sheets, start_date, end_date, failed_bases=()):
+        from report_preview import PreviewWindow
+
+        def export(metrics, cash_registers):
+            threading.Thread(target=self.export_preview, daemon=True,
+                             args=(metrics, cash_registers, bases, sheets, start_date, end_date, failed_bases)).start()
+
+        title = f"Предпросмотр: {', '.join(bases)} • {start_date:%d.%m.%Y} – {end_date:%d.%m.%Y}"
+        PreviewWindow(self.root, metrics, cash_registers, sheets, title, export)
+
+    def export_preview(self, metrics, cash_registers, bases, sheets, start_date, end_date, failed_bases=()):
+        """Запись показанной в предпросмотре таблицы в книгу Excel"""
+        from report_generator import ReportGenerator, build_report_info, default_report_path
+
+        excel_filename = default_report_path()
+        try:
+            report_info = build_report_info(bases, start_date, end_date, sheets, cash_registers, failed_bases)
+            generator = ReportGenerator(log_callback=self.log_message)
+            if generator.write_excel_report(metrics, cash_registers, excel_filename, sheets, report_info):
+                self.log_message(f"✅ Отчет создан: {excel_filename}")
+                self.show_message(messagebox.showinfo, "Успех", f"Отчет успешно создан!\n{excel_filename}")
+            else:
+                self.log_message("❌ Ошибка при создании отчета")
+                self.show_message(messagebox.showerror, "Ошибка", "Не удалось создать отчет")
+        except Exception as e:
+            self.log_message(f"❌ Ошибка: {str(e)}")
+            self.show_message(messagebox.showerror, "Ошибка", f"Произошла ошибка: {str(e)}")
+
     def finish_report_generation(self):
-        self.progress.stop()
-        self.run_button.config(state='normal')
\ No newline at end of file
+        self.update_progress()
+        self.job = None
+        self.cancel_button.config(state='disabled')
+        self.run_button.config(state='normal')
+        self.preview_button.config(state='normal')
\ No newline at end of file
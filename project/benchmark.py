@@ -0,0 +1,157 @@
+# benchmark.py — замеры загрузки и формирования отчета на локальном сервере-имитации iiko
+#
+# Примеры:
+#   python benchmark.py --scale medium
+#   python benchmark.py --bases 4 --stores 10 --days 365 --repeat 3 --save-baseline bench_baseline.json
+#   python benchmark.py --scale medium --baseline bench_baseline.json --tolerance 0.25
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from data_fetcher import fetch_bases
+from iiko_collector import get_collector
+from instrumentation import run_metrics
+from mock_iiko_server import MockIikoServer
+from report_generator import ReportGenerator, REPORT_SHEETS
+from resilience import TokenBucket
+
+# готовые масштабы: баз, касс на базу, дней, строк на кассу в день
+SCALES = {
+    'small': (2, 3, 31, 1),
+    'medium': (4, 8, 180, 1),
+    'large': (8, 12, 365, 2),
+}
+STAGES = ('fetch', 'metrics', 'excel', 'excel_streaming', 'total')
+BENCH_START = date(2024, 1, 1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры отчета План-Факт на синтетических данных")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--bases", type=int, help="баз (серверов-имитаций)")
+    parser.add_argument("--stores", type=int, help="касс на базу")
+    parser.add_argument("--days", type=int, help="дней в периоде")
+    parser.add_argument("--rows-per-day", type=int, help="строк OLAP на кассу в день")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа сервера, с")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов; в результат идет медиана")
+    parser.add_argument("--output", help="сохранить результат (.json)")
+    parser.add_argument("--save-baseline", metavar="ФАЙЛ", help="сохранить результат как базовый")
+    parser.add_argument("--baseline", metavar="ФАЙЛ", help="сравнить с базовым результатом")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="допустимое замедление относительно базового (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+def run_once(servers, days, work_dir):
+    """Один прогон: загрузка со всех серверов, таблица метрик и запись книги обоими способами"""
+    bases_config = {
+        f"База {index + 1}": {"url": server.url, "preset_id": "bench"}
+        for index, server in enumerate(servers)
+    }
+    for config in bases_config.values():
+        collector = get_collector(config["url"], cache=None)
+        # замеряем сам код, а не ограничение частоты запросов к серверу
+        collector.rate_limit = TokenBucket(rate=1e9, burst=1e9)
+
+    timings = {}
+    end = BENCH_START + timedelta(days=days - 1)
+    with run_metrics("benchmark") as run:
+        started = time.perf_counter()
+        olap_data = fetch_bases(bases_config, list(bases_config), BENCH_START, end,
+                                log=lambda message: None, cache=None)
+        timings['fetch'] = time.perf_counter() - started
+
+        generator = ReportGenerator(log_callback=lambda message: None)
+        started = time.perf_counter()
+        metrics, cash_registers = generator.prepare_report_data(olap_data)
+        timings['metrics'] = time.perf_counter() - started
+
+        for stage, streaming in (('excel', False), ('excel_streaming', True)):
+            generator.streaming = streaming
+            started = time.perf_counter()
+            generator.write_excel_report(metrics, cash_registers, Path(work_dir) / f"{stage}.xlsx",
+                                         list(REPORT_SHEETS))
+            timings[stage] = time.perf_counter() - started
+    timings['total'] = run.elapsed
+    return timings, run.summary(), len(olap_data)
+
+
+def median_timings(runs):
+    return {stage: statistics.median(run[stage] for run in runs) for stage in STAGES}
+
+
+def compare(result, baseline, tolerance, log=print):
+    """Этапы, замедлившиеся больше чем на tolerance относительно базового результата"""
+    if baseline.get('scale') != result['scale']:
+        log("⚠️ Масштаб базового результата отличается, сравнение может быть неточным")
+    regressions = []
+    for stage in STAGES:
+        old, new = baseline['timings'].get(stage), result['timings'][stage]
+        if not old:
+            continue
+        change = new / old - 1
+        mark = "❌" if change > tolerance else "✅"
+        log(f"{mark} {stage:<16}{old:>9.3f} → {new:>9.3f} с ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bases, stores, days, rows_per_day = SCALES[args.scale]
+    bases = args.bases or bases
+    stores = args.stores or stores
+    days = args.days or days
+    rows_per_day = args.rows_per_day or rows_per_day
+    scale = {'bases': bases, 'stores': stores, 'days': days, 'rows_per_day': rows_per_day,
+             'latency': args.latency}
+    print(f"Масштаб: {bases} баз × {stores} касс × {days} дней × {rows_per_day} строк")
+
+    servers = [
+        MockIikoServer(stores, rows_per_day, args.latency, name=f"База {index + 1}").start()
+        for index in range(bases)
+    ]
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for attempt in range(args.repeat):
+                timings, summary, row_count = run_once(servers, days, work_dir)
+                runs.append(timings)
+                print(f"Прогон {attempt + 1}: " + ", ".join(f"{stage} {timings[stage]:.3f} с" for stage in STAGES))
+    finally:
+        for server in servers:
+            server.stop()
+
+    result = {
+        'scale': scale,
+        'rows': row_count,
+        'python': sys.version.split()[0],
+        'timings': median_timings(runs),
+        'stages': summary['spans'],
+        'counters': summary['counters'],
+    }
+    print("Медиана: " + ", ".join(f"{stage} {result['timings'][stage]:.3f} с" for stage in STAGES))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"Результат сохранен: {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Замедление этапов: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
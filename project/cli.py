@@ -0,0 +1,230 @@
+# cli.py — формирование отчетов из командной строки (без графического интерфейса)
+#
+# Примеры:
+#   python cli.py --all-bases --period this-month
+#   python cli.py --bases "База 1" "База 2" --sheets 1 4 --period yesterday --period last-month
+#   python cli.py --all-bases --range 01.10.2025 15.10.2025 --output D:/Отчеты --workers 16
+#   python cli.py --all-bases --period this-month --incremental
+#   python cli.py --all-bases --period last-month --per-base --processes 4
+#   python cli.py --all-bases --period last-month --format xlsx parquet
+
+import argparse
+import multiprocessing
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+from config import BASES_CONFIG
+from data_fetcher import fetch_bases, MAX_WORKERS
+from incremental_report import refresh_report
+from instrumentation import run_metrics
+from olap_cache import OPEN_DAY_TTL
+from olap_frame import OlapFrame
+from periods import PERIOD_ALIASES, period_dates
+from report_generator import (ReportGenerator, DATA_FORMATS, FORMULA_MODES, REPORT_SHEETS, REPORTS_DIR,
+                              build_report_info, default_report_path)
+
+
+def add_bases_arguments(parser):
+    """Обязательный выбор баз: --bases или --all-bases (общий для cli.py и prefetch_service.py)"""
+    bases = parser.add_mutually_exclusive_group(required=True)
+    bases.add_argument("--bases", nargs="+", metavar="БАЗА", help="базы из BASES_CONFIG")
+    bases.add_argument("--all-bases", action="store_true", help="все базы из BASES_CONFIG")
+
+
+def selected_bases(parser, args, bases_config=BASES_CONFIG):
+    """Имена выбранных баз; неизвестные базы — ошибка разбора аргументов"""
+    base_names = list(bases_config) if args.all_bases else args.bases
+    unknown = [name for name in base_names if name not in bases_config]
+    if unknown:
+        parser.error(f"нет в BASES_CONFIG: {', '.join(unknown)}")
+    return base_names
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка отчетов План-Факт из iiko без графического интерфейса")
+    add_bases_arguments(parser)
+    parser.add_argument("--sheets", nargs="+", type=int, choices=sorted(REPORT_SHEETS),
+                        default=sorted(REPORT_SHEETS), help="номера листов (по умолчанию все)")
+    parser.add_argument("--period", action="append", default=[], metavar="ПЕРИОД",
+                        help="предустановленный период; можно указать несколько раз. "
+                             f"Варианты: {', '.join(PERIOD_ALIASES)} или русские названия")
+    parser.add_argument("--range", action="append", nargs=2, default=[], metavar=("С", "ПО"),
+                        help="произвольный период в формате ДД.ММ.ГГГГ; можно указать несколько раз")
+    parser.add_argument("--output", help="файл отчета (для одного отчета) или папка для отчетов")
+    parser.add_argument("--format", nargs="+", choices=("xlsx",) + DATA_FORMATS, default=["xlsx"],
+                        dest="formats", metavar="ФОРМАТ",
+                        help="xlsx — книга Excel; csv, parquet, feather — данные без оформления "
+                             "(строка на базу, кассу, дату и метрику). Можно несколько")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="одновременных запросов к базам")
+    parser.add_argument("--refresh", action="store_true",
+                        help="загрузить все дни заново, минуя кэш (без него текущий день берется из кэша, "
+                             f"если загружен не больше {OPEN_DAY_TTL // 60} мин назад)")
+    parser.add_argument("--per-base", action="store_true", help="отдельный отчет по каждой базе")
+    parser.add_argument("--processes", type=int,
+                        help="процессов для записи отчетов и листов (по умолчанию по числу ядер, 1 — без процессов)")
+    parser.add_argument("--formulas", choices=FORMULA_MODES, default='formulas',
+                        help="%% выполнения и ИТОГО: формулы, готовые значения (values) "
+                             "или формулы с сохраненными значениями (cached)")
+    parser.add_argument("--save-data", metavar="ФАЙЛ",
+                        help="сохранить загруженные данные (.npz; .parquet/.feather при наличии pyarrow)")
+    parser.add_argument("--load-data", metavar="ФАЙЛ",
+                        help="строить отчеты по сохраненным данным, без запросов к iiko")
+    parser.add_argument("--metrics", metavar="ФАЙЛ",
+                        help="сохранить время этапов и счетчики запуска (.json или .csv)")
+    parser.add_argument("--profile", metavar="ФАЙЛ", help="профиль cProfile запуска (.prof)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="дополнить последний отчет за тот же период вместо нового файла")
+    args = parser.parse_args(argv)
+    if not args.period and not args.range:
+        parser.error("укажите хотя бы один --period или --range")
+    return parser, args
+
+
+def resolve_periods(parser, args):
+    """Список периодов отчетов (start, end) в порядке аргументов"""
+    periods = []
+    for period in args.period:
+        start, end = period_dates(period)
+        if start is None:
+            parser.error(f"неизвестный период: {period}")
+        periods.append((start.date(), end.date()))
+    for start_str, end_str in args.range:
+        try:
+            start = datetime.strptime(start_str, "%d.%m.%Y").date()
+            end = datetime.strptime(end_str, "%d.%m.%Y").date()
+        except ValueError:
+            parser.error(f"неверная дата в периоде {start_str} - {end_str}")
+        if start > end:
+            parser.error("дата начала не может быть позже даты окончания")
+        periods.append((start, end))
+    return periods
+
+
+def merge_spans(periods):
+    """Объединение пересекающихся и соседних периодов в отрезки для загрузки"""
+    spans = []
+    for start, end in sorted(set(periods)):
+        if spans and (start - spans[-1][1]).days <= 1:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return [tuple(span) for span in spans]
+
+
+def output_path(output, start, end, report_count, base_name=None):
+    suffix = f"_{start:%d.%m.%Y}-{end:%d.%m.%Y}"
+    if base_name is not None:
+        suffix += "_" + re.sub(r'[\\/:*?"<>|]', "_", base_name)
+    if output is None:
+        return default_report_path(suffix if report_count > 1 else "")
+    output = Path(output)
+    if output.suffix.lower().lstrip(".") in ("xlsx",) + DATA_FORMATS and report_count == 1:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        return output
+    return default_report_path(suffix, output)
+
+
+def log_message(message, time_format="%H:%M:%S"):
+    timestamp = datetime.now().strftime(time_format)
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    base_names = selected_bases(parser, args)
+    periods = resolve_periods(parser, args)
+
+    with run_metrics("cli", args.profile) as run:
+        code = run_reports(args, base_names, periods)
+    log_message("=== Время этапов ===\n" + run.format_table())
+    if args.metrics:
+        log_message(f"📊 Замеры сохранены: {run.export(args.metrics)}")
+    if args.profile:
+        log_message(f"📊 Профиль сохранен: {args.profile}")
+    return code
+
+
+def run_reports(args, base_names, periods):
+    """Загрузка данных и формирование отчетов; код возврата процесса"""
+    if args.incremental:
+        reports_dir, report_path = REPORTS_DIR, None
+        if args.output is not None:
+            output = Path(args.output)
+            # один отчет с явным именем файла дополняется только в этом файле (как его пишет output_path)
+            if output.suffix.lower() == ".xlsx" and len(periods) == 1 and not args.per_base:
+                report_path = output
+            else:
+                reports_dir = output
+        periods = [
+            (start, end) for start, end in periods
+            if refresh_report(BASES_CONFIG, base_names, start, end, args.sheets, reports_dir,
+                              log=log_message, report_path=report_path,
+                              max_workers=args.workers, refresh=args.refresh) is None
+        ]
+        if not periods:
+            return 0
+
+    base_results = []
+    if args.load_data:
+        log_message(f"=== Загрузка данных из {args.load_data} ===")
+        olap_data = OlapFrame.load(args.load_data)
+    else:
+        log_message("=== Начало получения данных из iiko ===")
+        olap_data = OlapFrame.concat(
+            fetch_bases(
+                BASES_CONFIG, base_names, span_start, span_end,
+                max_workers=args.workers, log=log_message, refresh=args.refresh, results=base_results
+            )
+            for span_start, span_end in merge_spans(periods)
+        )
+    if args.save_data:
+        log_message(f"💾 Данные сохранены: {olap_data.save(args.save_data)}")
+
+    generator = ReportGenerator(log_callback=log_message, processes=args.processes, formulas=args.formulas)
+    groups = [[base_name] for base_name in base_names] if args.per_base else [base_names]
+    failed_bases = [result.base_name for result in base_results if result.failed]
+    report_count = len(periods) * len(groups)
+    reports = []
+    failed = 0
+    for start, end in periods:
+        # данные общих отрезков делятся между отчетами
+        period_data = olap_data.slice(start, end)
+        for group in groups:
+            base_label = group[0] if args.per_base else None
+            report_data = period_data.select_bases(group) if args.per_base else period_data
+            title = f"{start:%d.%m.%Y} - {end:%d.%m.%Y}" + (f" ({base_label})" if base_label else "")
+            log_message(f"=== Отчет за {title} ===")
+            try:
+                metrics, cash_registers = generator.prepare_report_data(report_data) if len(report_data) else (None, [])
+            except Exception as e:
+                log_message(f"❌ Ошибка при подготовке данных: {str(e)}")
+                metrics = None
+            if metrics is None:
+                log_message("❌ Нет данных для создания отчета")
+                failed += 1
+                continue
+            path = output_path(args.output, start, end, report_count, base_label)
+            for data_format in DATA_FORMATS:
+                if data_format not in args.formats:
+                    continue
+                try:
+                    generator.write_data_export(metrics, cash_registers, path.with_suffix(f".{data_format}"), args.sheets)
+                except Exception as e:
+                    log_message(f"❌ Ошибка при выгрузке данных в {data_format}: {str(e)}")
+                    failed += 1
+            if "xlsx" in args.formats:
+                reports.append((
+                    metrics, cash_registers, path.with_suffix(".xlsx"), args.sheets,
+                    build_report_info(group, start, end, args.sheets, cash_registers, failed_bases),
+                ))
+    # независимые отчеты пишутся в отдельных процессах
+    failed += generator.write_excel_reports(reports)
+
+    # код 1 и при частичном отчете, чтобы планировщик заметил упавшие базы
+    return 1 if failed or failed_bases else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
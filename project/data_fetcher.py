@@ -0,0 +1,217 @@
+# data_fetcher.py — параллельная загрузка данных из нескольких баз iiko
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from iiko_collector import get_collector
+from instrumentation import count, span
+from olap_cache import OPEN_DAY_TTL, OlapCache
+from olap_frame import DATE_FIELD, FACT_FIELDS, OlapFrame
+from report_job import JobCancelled
+from resilience import RequestStats
+
+MAX_WORKERS = 8      # сколько баз опрашиваем одновременно
+BASE_TIMEOUT = 300   # секунд на одну базу, после чего её данные не ждём
+FAILED_RETRY_ROUNDS = 1  # повторных проходов только по базам, загрузка которых не удалась
+
+# Отчеты GUI и cli.py берут текущий день из кэша, если он загружен не
+# больше OPEN_DAY_TTL назад (даже без prefetch_service); свежие данные —
+# «Обновить кэш» / --refresh.
+DEFAULT_CACHE = OlapCache(open_day_ttl=OPEN_DAY_TTL)
+
+# OLAP-запрос фактических показателей: сервер сам суммирует их по дням и кассам
+FACT_QUERY = {
+    'reportType': 'SALES',
+    'buildSummary': 'false',
+    'groupByRowFields': [DATE_FIELD, 'Store.Name'],
+    'groupByColFields': [],
+    'aggregateFields': list(FACT_FIELDS),
+    'filters': {
+        'OrderDeleted': {'filterType': 'IncludeValues', 'values': ['NOT_DELETED']},
+        'DeletedWithWriteoff': {'filterType': 'IncludeValues', 'values': ['NOT_DELETED']},
+    },
+}
+
+
+def fetch_base(base_name, config, start_date, end_date,
+               cache=DEFAULT_CACHE, refresh=False, job=None, stats=None):
+    """Получение данных одной базы.
+
+    Каждый пресет запрашивается один раз за период: если в BASES_CONFIG
+    не указан отдельный "average_preset_id", средние показатели берутся
+    из того же ответа, что и основные данные. С "olap_facts": True факт
+    вместо пресета средних запрашивается OLAP-запросом FACT_QUERY (с
+    дополнительными фильтрами из "olap_filters"): сервер отдает готовую
+    матрицу день × касса, а из пресета нужны только планы.
+    """
+    collector = get_collector(config["url"], cache=cache)
+    responses = {}
+
+    def get(preset_id):
+        if preset_id not in responses:
+            responses[preset_id] = collector.get_report_data(
+                preset_id, start_date, end_date, refresh=refresh, job=job, stats=stats
+            )
+        return responses[preset_id]
+
+    data = get(config["preset_id"])
+    if config.get("olap_facts"):
+        avg_data = collector.get_olap_data(
+            fact_query(config), start_date, end_date, refresh=refresh, job=job, stats=stats
+        )
+    else:
+        avg_data = get(config.get("average_preset_id", config["preset_id"]))
+    if job is not None:
+        job.check()
+    return data, avg_data
+
+
+def fact_query(config):
+    """FACT_QUERY с фильтрами базы из "olap_filters" (например, по подразделению)"""
+    filters = dict(FACT_QUERY['filters'], **config.get("olap_filters", {}))
+    return dict(FACT_QUERY, filters=filters)
+
+
+class BaseResult:
+    """Итог загрузки одной базы: статус, число попыток запросов, время и данные.
+
+    status: 'ok', 'empty' (сервер ответил без строк), 'failed' (ошибка после
+    всех повторов) или 'timeout' (база не уложилась в BASE_TIMEOUT).
+    """
+
+    def __init__(self, base_name, status, attempts=0, latency=0.0, error=None, frame=None):
+        self.base_name = base_name
+        self.status = status
+        self.attempts = attempts
+        self.latency = latency
+        self.error = error
+        self.frame = frame
+
+    @property
+    def failed(self):
+        return self.status in ('failed', 'timeout')
+
+    def __repr__(self):
+        return f"BaseResult({self.base_name!r}, {self.status!r}, attempts={self.attempts}, latency={self.latency:.1f})"
+
+
+def fetch_bases(bases_config, base_names, start_date, end_date,
+                max_workers=MAX_WORKERS, timeout=BASE_TIMEOUT, log=print,
+                cache=DEFAULT_CACHE, refresh=False, job=None,
+                retry_rounds=FAILED_RETRY_ROUNDS, results=None):
+    """Параллельное получение данных по списку баз в один OlapFrame.
+
+    Базы, загрузка которых завершилась ошибкой, запрашиваются повторно
+    (до retry_rounds раз), успешные не перезапрашиваются. Итоги по базам
+    (BaseResult в порядке base_names) пишутся в лог и, если передан список
+    results, добавляются в него. Базы склеиваются в порядке base_names,
+    поэтому отчет получается таким же, как при последовательной загрузке.
+    При отмене job выбрасывается JobCancelled.
+    """
+    by_name = {}
+    pending = list(base_names)
+    with span('fetch.bases'):
+        for round_number in range(retry_rounds + 1):
+            if round_number:
+                log(f"🔁 Повторная загрузка баз: {', '.join(pending)}")
+            for result in fetch_base_results(bases_config, pending, start_date, end_date,
+                                             max_workers, timeout, log, cache, refresh, job):
+                by_name[result.base_name] = result
+            # зависшую по таймауту базу не повторяем: её запрос может еще выполняться
+            pending = [name for name in pending if by_name[name].status == 'failed']
+            if not pending:
+                break
+
+    ordered = [by_name[name] for name in base_names]
+    if results is not None:
+        results.extend(ordered)
+    failed = [result for result in ordered if result.failed]
+    if failed:
+        log(f"⚠️ Без данных остались базы: {', '.join(result.base_name for result in failed)}")
+    return OlapFrame.concat(result.frame for result in ordered if result.frame is not None)
+
+
+def fetch_base_results(bases_config, base_names, start_date, end_date,
+                       max_workers=MAX_WORKERS, timeout=BASE_TIMEOUT, log=print,
+                       cache=DEFAULT_CACHE, refresh=False, job=None):
+    """Один проход параллельной загрузки: BaseResult для каждой базы в порядке base_names.
+
+    Ответ каждой базы переводится в колонки сразу в её потоке, строки-словари
+    после этого не хранятся.
+    """
+    if not base_names:
+        return []
+
+    started = {}
+    stats = {base_name: RequestStats() for base_name in base_names}
+    lock = threading.Lock()
+    if job is not None:
+        job.add_units(len(base_names))
+
+    def task(base_name):
+        with lock:
+            started[base_name] = time.monotonic()
+        log(f"=== Работаем с базой: {base_name} ===")
+        data, avg_data = fetch_base(base_name, bases_config[base_name], start_date, end_date,
+                                    cache, refresh, job, stats[base_name])
+        has_data = bool(data and data.get('data'))
+        with span('frame.build'):
+            frame = OlapFrame.from_base(base_name, data, avg_data,
+                                        olap_facts=bool(bases_config[base_name].get("olap_facts")))
+        count('frame.rows', len(frame))
+        return has_data, frame
+
+    results = []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(base_names))))
+    try:
+        futures = [(base_name, executor.submit(task, base_name)) for base_name in base_names]
+        for base_name, future in futures:
+            done = _wait_result(future, base_name, started, lock, timeout, job)
+            if job is not None:
+                job.complete_unit()
+            with lock:
+                latency = time.monotonic() - started.get(base_name, time.monotonic())
+            attempts = stats[base_name].attempts
+            if done is None:
+                log(f"⏱ База {base_name} не ответила за {timeout} с, пропускаем")
+                results.append(BaseResult(base_name, 'timeout', attempts, latency,
+                                          f"нет ответа за {timeout} с"))
+                continue
+            try:
+                has_data, frame = future.result()
+            except JobCancelled:
+                raise
+            except Exception as e:
+                log(f"❌ Ошибка при получении данных базы {base_name} "
+                    f"(попыток: {attempts}, {latency:.1f} с): {str(e)}")
+                results.append(BaseResult(base_name, 'failed', attempts, latency, str(e)))
+                continue
+
+            if not has_data:
+                log(f"⚠️ Нет данных из базы {base_name}")
+            results.append(BaseResult(base_name, 'ok' if has_data else 'empty', attempts, latency, frame=frame))
+    finally:
+        # зависшие запросы не держат отчет: их потоки завершатся по таймауту сессии
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def _wait_result(future, base_name, started, lock, timeout, job=None):
+    """Ожидание задачи базы с отсчетом таймаута от момента её старта"""
+    while True:
+        if job is not None:
+            job.check()
+        with lock:
+            base_started = started.get(base_name)
+        if base_started is None:
+            remaining = timeout
+        else:
+            remaining = timeout - (time.monotonic() - base_started)
+            if remaining <= 0:
+                return future if future.done() else None
+        try:
+            future.exception(timeout=min(remaining, 0.5))
+            return future
+        except FutureTimeoutError:
+            continue
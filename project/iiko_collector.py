@@ -1,64 +1,579 @@
 # iiko_collector.py — класс для взаимодействия с API iiko
 
 import requests
+import gzip
 import hashlib
-from datetime import timedelta, datetime
 import json
+import atexit
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta, datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlsplit
 import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from olap_cache import row_day
+from olap_stream import OlapParseError, OlapStreamParser
+from instrumentation import add_time, count, span
+from report_job import JobCancelled
+from resilience import IikoRequestError, RetryPolicy, host_bucket, retry_after_seconds
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+CHUNK_DAYS = 'month' # длина части периода: число дней, 'month' или None (без разбиения)
+CHUNK_WORKERS = 4    # одновременных запросов частей к одному серверу
+TOKEN_TTL = 30 * 60  # секунд, после которых токен получаем заново
+POOL_SIZE = 10       # соединений keep-alive на сервер
+REQUEST_TIMEOUT = (10, 120)  # секунд на соединение и на ожидание очередной порции ответа
+RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    OlapParseError,  # оборванный или поврежденный JSON (не любой ValueError: ошибки URL не повторяем)
+)
+READ_CHUNK_SIZE = 64 * 1024
+RAW_DIR = "raw_data" # куда save_raw пишет ответы сервера
+RAW_GZIP = False     # сжимать ли сохраняемые ответы
+PRESET_PATH = "/v2/reports/olap/byPresetId/"  # отчет по сохраненному пресету (GET)
+OLAP_QUERY_PATH = "/v2/reports/olap"          # произвольный OLAP-запрос (POST)
+
+_collectors = {}
+_collectors_lock = threading.Lock()
+_request_job = threading.local()  # ReportJob запроса, который выполняется в этом потоке
+
+
+class _SocketCloser:
+    """Разрыв сокета соединения из другого потока (для ReportJob.cancel).
+
+    shutdown, в отличие от close, прерывает и recv, который уже ждет
+    ответа сервера, поэтому отмена не ждет таймаута чтения.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def close(self):
+        sock = getattr(self.connection, 'sock', None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _CancellableConnection:
+    """Соединение urllib3, которое на время запроса регистрируется в ReportJob потока"""
+
+    def request(self, *args, **kwargs):
+        job = getattr(_request_job, 'job', None)
+        if job is not None:
+            closer = _SocketCloser(self)
+            _request_job.closers.append(closer)
+            job.track(closer)
+            job.check()
+        return super().request(*args, **kwargs)
+
+
+class _CancellableHTTPConnection(_CancellableConnection, HTTPConnection):
+    pass
+
+
+class _CancellableHTTPSConnection(_CancellableConnection, HTTPSConnection):
+    pass
+
+
+class _CancellableHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _CancellableHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+class _CancellableAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter, соединения которого можно разорвать отменой ReportJob"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _CancellableHTTPPool, 'https': _CancellableHTTPSPool}
+
+
 class IikoDataCollector:
-    def __init__(self, base_url, login="login", password="password"):
+    def __init__(self, base_url, login="login", password="password", timeout=REQUEST_TIMEOUT, cache=None,
+                 chunk_days=CHUNK_DAYS, chunk_workers=CHUNK_WORKERS, retry_policy=None,
+                 raw_gzip=RAW_GZIP):
         self.base_url = base_url.strip()
         self.login = login
         self.password = password
+        self.timeout = timeout
+        self.cache = cache
+        self.chunk_days = chunk_days
+        self.chunk_workers = chunk_workers
+        # повторы с задержкой при сетевых ошибках и 429/5xx
+        self.retry_policy = retry_policy or RetryPolicy()
+        # общий для всех коллекторов сервера ограничитель частоты запросов
+        self.rate_limit = host_bucket(self.base_url)
+        self.raw_gzip = raw_gzip
         self.token = None
+        self.token_expires = 0
+        self._token_lock = threading.Lock()
         self.session = requests.Session()
         self.session.verify = False
+        adapter = _CancellableAdapter(pool_maxsize=max(POOL_SIZE, chunk_workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
-    def auth(self):
-        """Аутентификация в системе iiko"""
+    def auth(self, job=None, stats=None):
+        """Аутентификация в системе iiko; возвращает токен.
+
+        Сетевые ошибки, таймауты и статусы 429/5xx повторяются по
+        retry_policy, как запросы отчетов; попытки учитываются в stats.
+        Если токен так и не получен, выбрасывается IikoRequestError с
+        последней ошибкой (неверный пароль не повторяется).
+        """
         auth_url = f"{self.base_url}/auth"
+        password_hash = hashlib.sha1(self.password.encode()).hexdigest()
+        policy = self.retry_policy
+        error = None
+        for attempt in range(1, policy.attempts + 1):
+            if job is not None:
+                job.check()
+            if stats is not None:
+                stats.add_attempt()
+
+            retry_after = None
+            try:
+                with span('iiko.rate_limit_wait'):
+                    self._wait(self.rate_limit.reserve(), job)
+                with span('iiko.auth'), _cancellable(job):
+                    response = self.session.post(
+                        auth_url,
+                        data={'login': self.login, 'pass': password_hash},
+                        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                        timeout=self.timeout
+                    )
+                if response.status_code == 200:
+                    self.token = response.text.strip()
+                    self.token_expires = time.monotonic() + TOKEN_TTL
+                    return self.token
+                retry_after = retry_after_seconds(response)
+                error = IikoRequestError(f"Не удалось авторизоваться на {self.base_url}: HTTP {response.status_code}",
+                                         response.status_code, attempt)
+                if not policy.is_retryable_status(response.status_code):
+                    raise error
+            except (JobCancelled, IikoRequestError):
+                raise
+            except RETRYABLE_ERRORS as e:
+                if job is not None:
+                    job.check()
+                error = IikoRequestError(f"Не удалось авторизоваться на {self.base_url}: {type(e).__name__}: {e}",
+                                         attempts=attempt)
+
+            if attempt < policy.attempts:
+                count('iiko.retries')
+                with span('iiko.retry_wait'):
+                    self._wait(policy.delay(attempt, retry_after), job)
+
+        error.attempts = policy.attempts
+        raise error
+
+    def ensure_token(self, job=None, stats=None):
+        """Действующий токен: сохраненный или полученный заново после истечения (IikoRequestError, если не удалось)"""
+        with self._token_lock:
+            if self.token and time.monotonic() < self.token_expires:
+                return self.token
+            if self.token:
+                self.logout(job)
+            return self.auth(job, stats)
+
+    def reauth(self, rejected_token, job=None, stats=None):
+        """Повторная аутентификация после 401/403 (один раз на отвергнутый токен)"""
+        with self._token_lock:
+            if self.token != rejected_token:
+                return self.token
+            self.token = None
+            return self.auth(job, stats)
+
+    def logout(self, job=None):
+        """Освобождение токена, чтобы не занимать слот лицензии iiko (при отмене job запрос прерывается)"""
+        if not self.token:
+            return
+        if job is not None:
+            job.check()
         try:
-            password_hash = hashlib.sha1(self.password.encode()).hexdigest()
-            response = self.session.post(
-                auth_url,
-                data={'login': self.login, 'pass': password_hash},
-                headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            )
-            if response.status_code == 200:
-                self.token = response.text.strip()
-                return True
-            return False
+            with _cancellable(job):
+                self.session.get(f"{self.base_url}/logout", params={'key': self.token}, timeout=self.timeout)
         except Exception:
-            return False
-
-    def get_report_data(self, preset_id, date_from, date_to, save_raw=False):
-        """Получение данных отчета"""
-        if not self.token and not self.auth():
-            return None
-        url = f"{self.base_url}/v2/reports/olap/byPresetId/{preset_id}"
-        
+            pass
+        self.token = None
+
+    def get_report_data(self, preset_id, date_from, date_to, save_raw=False, refresh=False, job=None, stats=None):
+        """Получение данных отчета.
+
+        Длинный период делится на части по chunk_days дней, которые
+        запрашиваются параллельно и склеиваются по порядку. Если коллектору
+        передан кэш, закрытые дни берутся с диска, а с сервера запрашиваются
+        только недостающие дни не позже сегодняшнего. refresh=True игнорирует кэш. job (ReportJob)
+        получает прогресс по частям и скачанным байтам и может прервать загрузку.
+        stats (RequestStats) считает попытки запросов. Если часть периода не
+        удалось получить после всех повторов, выбрасывается IikoRequestError.
+        """
+        return self._get_data(preset_id, date_from, date_to, save_raw, refresh, job, stats)
+
+    def get_olap_data(self, query, date_from, date_to, save_raw=False, refresh=False, job=None, stats=None):
+        """Получение данных произвольного OLAP-запроса (POST /v2/reports/olap).
+
+        query — тело запроса iiko (reportType, groupByRowFields,
+        aggregateFields, filters) без фильтра по дате: фильтр OpenDate.Typed
+        на каждую часть периода добавляется сам. Сервер сам группирует строки,
+        поэтому приходит ровно нужная матрица, а не строки пресета. Части
+        периода, кэш и повторы — как в get_report_data; в кэше запрос хранится
+        под ключом olap:<хэш тела запроса>. В groupByRowFields должен быть
+        OpenDate.Typed, иначе строки нельзя разложить по дням кэша.
+        """
+        return self._get_data(query, date_from, date_to, save_raw, refresh, job, stats)
+
+    def _get_data(self, report, date_from, date_to, save_raw=False, refresh=False, job=None, stats=None):
+        """Загрузка отчета report (id пресета или тело OLAP-запроса) по частям и с кэшем"""
+        if self.cache is None:
+            return self._fetch_uncached(report, _days_between(date_from, date_to), save_raw, job, stats)
+
+        days = _days_between(date_from, date_to)
+        cache_key = report_key(report)
+        day_rows = {}
+        if not refresh:
+            for day in days:
+                rows = self.cache.get_day(self.base_url, cache_key, day)
+                if rows is not None:
+                    day_rows[day] = rows
+            count('cache.days_hit', len(day_rows))
+
+        # будущих дней в OLAP по продажам еще нет: без этого отчет за текущий месяц или год
+        # каждый раз запрашивал бы их с сервера и не брался целиком из кэша
+        today = datetime.now().date()
+        past_days = [day for day in days if day <= today]
+        missing = [day for day in past_days if day not in day_rows]
+        chunks = []
+        for range_days in _contiguous_ranges(missing):
+            chunks.extend(_split_chunks(range_days, self.chunk_days))
+        results = self._fetch_chunks(report, chunks, save_raw, job, stats)
+
+        for chunk_days, json_data in zip(chunks, results):
+            if isinstance(json_data, Exception):
+                continue
+            rows = json_data.get('data', [])
+            if any(row_day(row) is None for row in rows):
+                # строки без даты нельзя разложить по дням — берем весь период по сегодня без кэша
+                if len(chunks) == 1 and len(missing) == len(past_days):
+                    return json_data
+                return self._fetch_uncached(report, past_days, save_raw, job, stats)
+            # успешные части сохраняем даже при сбое соседних,
+            # чтобы повторный запуск догрузил только упавшие
+            with span('cache.put'):
+                self.cache.put_days(self.base_url, cache_key, chunk_days, rows)
+            for day in chunk_days:
+                day_rows[day] = []
+            for row in rows:
+                day = _parse_day(row_day(row))
+                day_rows.setdefault(day, []).append(row)
+        _raise_failed(results)
+
+        data = []
+        for day in sorted(day_rows):
+            data.extend(day_rows[day])
+        return {'data': data}
+
+    def _fetch_uncached(self, report, days, save_raw=False, job=None, stats=None):
+        """Загрузка дней days частями по chunk_days без кэша; ответы частей склеиваются по порядку"""
+        results = self._fetch_chunks(report, _split_chunks(days, self.chunk_days), save_raw, job, stats)
+        _raise_failed(results)
+        if len(results) == 1:
+            return results[0]
+        return {'data': [row for result in results for row in result.get('data', [])]}
+
+    def _fetch_chunks(self, report, chunks, save_raw=False, job=None, stats=None):
+        """Параллельная загрузка частей периода.
+
+        Для каждой части возвращается ответ или IikoRequestError, чтобы
+        успешные части можно было сохранить в кэш и при сбое соседних.
+        """
+        if not chunks:
+            return []
+        if job is not None:
+            job.add_units(len(chunks))
+
+        def fetch(chunk_days):
+            try:
+                return self._fetch_range(report, chunk_days[0], chunk_days[-1], save_raw, job, stats)
+            except IikoRequestError as e:
+                return e
+            finally:
+                if job is not None:
+                    job.complete_unit()
+
+        if len(chunks) == 1:
+            return [fetch(chunks[0])]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.chunk_workers, len(chunks)))) as executor:
+            return list(executor.map(fetch, chunks))
+
+    def _fetch_range(self, report, date_from, date_to, save_raw=False, job=None, stats=None):
+        """Запрос OLAP-отчета за период с сервера: пресета (GET) или произвольного запроса (POST).
+
+        Сетевые ошибки, таймауты, оборванные ответы и статусы 429/5xx
+        повторяются по retry_policy с растущей случайной задержкой (учитывая
+        Retry-After), после 401/403 токен один раз получается заново, не
+        расходуя попыток. Если данные так и не получены, выбрасывается
+        IikoRequestError.
+        """
         adjusted_date_to = date_to + timedelta(days=1)
-        
-        params = {
-            'key': self.token,
-            'dateFrom': date_from.strftime('%Y-%m-%d'),
-            'dateTo': adjusted_date_to.strftime('%Y-%m-%d')
-        }
+        if isinstance(report, dict):
+            method, url = 'POST', f"{self.base_url}{OLAP_QUERY_PATH}"
+            body = _with_date_filter(report, date_from, adjusted_date_to)
+            params = {}
+        else:
+            method, url = 'GET', f"{self.base_url}{PRESET_PATH}{report}"
+            body = None
+            params = {
+                'dateFrom': date_from.strftime('%Y-%m-%d'),
+                'dateTo': adjusted_date_to.strftime('%Y-%m-%d')
+            }
+        policy = self.retry_policy
+        error = None
+        reauthed = False
+        attempt = 1
+        while attempt <= policy.attempts:
+            if job is not None:
+                job.check()
+            token = self.ensure_token(job, stats)
+            params['key'] = token
+            if stats is not None:
+                stats.add_attempt()
+
+            retry_after = None
+            try:
+                with span('iiko.rate_limit_wait'):
+                    self._wait(self.rate_limit.reserve(), job)
+                with span('iiko.olap_request'), _cancellable(job):
+                    response = self.session.request(method, url, params=params, json=body,
+                                                    timeout=self.timeout, stream=True)
+                if response.status_code in (401, 403) and not reauthed:
+                    # истекший токен: повтор с новым не расходует попытки retry_policy
+                    response.close()
+                    reauthed = True
+                    error = IikoRequestError(f"HTTP {response.status_code}", response.status_code, attempt)
+                    self.reauth(token, job, stats)
+                    continue
+                if response.status_code == 200:
+                    return self._read_json(response, job, self._raw_path(report, date_from) if save_raw else None)
+                retry_after = retry_after_seconds(response)
+                response.close()
+                error = IikoRequestError(f"HTTP {response.status_code}", response.status_code, attempt)
+                if not policy.is_retryable_status(response.status_code):
+                    raise error
+            except (JobCancelled, IikoRequestError):
+                raise
+            except RETRYABLE_ERRORS as e:
+                if job is not None:
+                    job.check()
+                error = IikoRequestError(f"{type(e).__name__}: {e}", attempts=attempt)
+
+            if attempt < policy.attempts:
+                count('iiko.retries')
+                with span('iiko.retry_wait'):
+                    self._wait(policy.delay(attempt, retry_after), job)
+            attempt += 1
+
+        error.attempts = policy.attempts
+        raise error
+
+    def _raw_path(self, report, date_from):
+        """Файл для сохранения ответа сервера (save_raw).
+
+        В имени — сервер, отчет и случайный суффикс: параллельные базы и
+        части периода, запрошенные в одну секунду, не перезаписывают друг друга.
+        """
+        Path(RAW_DIR).mkdir(exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        extension = "json.gz" if self.raw_gzip else "json"
+        host = urlsplit(self.base_url).netloc or self.base_url
+        name = f"report_{host}_{report_key(report)}_{timestamp}_{date_from:%Y-%m-%d}_{uuid.uuid4().hex[:8]}"
+        return Path(RAW_DIR) / f"{_safe_file_name(name)}.{extension}"
+
+    def _wait(self, seconds, job=None):
+        """Пауза перед запросом или повтором; при отмене job прерывается"""
+        if seconds <= 0:
+            return
+        if job is not None:
+            job.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _read_json(self, response, job=None, raw_path=None):
+        """Потоковое чтение и разбор тела ответа.
+
+        Строки отчета разбираются по мере скачивания (OlapStreamParser), учет
+        байт и отмена job проверяются на каждой порции. При raw_path байты
+        ответа пишутся в файл без перекодирования (с gzip при raw_gzip).
+        """
+        if job is not None:
+            job.track(response)
+        raw_file = None
         try:
-            response = self.session.get(url, params=params)
-            if response.status_code == 200:
-                json_data = response.json()
-                if save_raw:
-                    Path("raw_data").mkdir(exist_ok=True)
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"raw_data/report_{timestamp}.json"
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        json.dump(json_data, f, ensure_ascii=False, indent=2)
-                return json_data
-            return None
-        except Exception:
-            return None
\ No newline at end of file
+            if raw_path is not None:
+                raw_file = gzip.open(raw_path, 'wb') if self.raw_gzip else open(raw_path, 'wb')
+            parser = OlapStreamParser()
+            decode_time = 0.0
+            size = 0
+            with span('iiko.olap_body'):
+                for part in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                    if job is not None:
+                        job.check()
+                        job.add_bytes(len(part))
+                    size += len(part)
+                    if raw_file is not None:
+                        raw_file.write(part)
+                    started = time.perf_counter()
+                    parser.feed(part)
+                    decode_time += time.perf_counter() - started
+                started = time.perf_counter()
+                result = parser.close()
+            # время разбора JSON входит в iiko.olap_body, здесь — отдельно
+            add_time('iiko.json_decode', decode_time + time.perf_counter() - started)
+            count('iiko.bytes', size)
+            count('iiko.rows', len(result.get('data', [])))
+            return result
+        finally:
+            if raw_file is not None:
+                raw_file.close()
+            if job is not None:
+                job.untrack(response)
+            response.close()
+
+
+def get_collector(base_url, login="login", password="password", **options):
+    """Общий для процесса коллектор базы.
+
+    Коллектор хранит сессию с keep-alive соединениями и токен между запусками
+    отчета. Переданные options (timeout, cache, chunk_*, retry_policy) обновляют настройки
+    существующего коллектора.
+    """
+    key = (base_url.strip(), login)
+    with _collectors_lock:
+        collector = _collectors.get(key)
+        if collector is None or collector.password != password:
+            collector = IikoDataCollector(base_url, login, password, **options)
+            _collectors[key] = collector
+        else:
+            for name, value in options.items():
+                setattr(collector, name, value)
+        return collector
+
+
+@atexit.register
+def release_collectors():
+    """Освобождение токенов всех коллекторов при завершении процесса"""
+    with _collectors_lock:
+        collectors = list(_collectors.values())
+        _collectors.clear()
+    for collector in collectors:
+        collector.logout()
+        collector.session.close()
+
+@contextmanager
+def _cancellable(job):
+    """Соединения запросов внутри блока регистрируются в job: отмена разрывает их сокеты,
+    даже если сервер еще не начал отвечать"""
+    if job is None:
+        yield
+        return
+    _request_job.job = job
+    _request_job.closers = []
+    try:
+        yield
+    finally:
+        for closer in _request_job.closers:
+            job.untrack(closer)
+        _request_job.job = None
+        _request_job.closers = []
+
+
+def report_key(report):
+    """Ключ отчета для кэша: id пресета или olap:<хэш> тела OLAP-запроса"""
+    if not isinstance(report, dict):
+        return report
+    body = json.dumps(report, sort_keys=True, ensure_ascii=False)
+    return f"olap:{hashlib.sha1(body.encode()).hexdigest()[:16]}"
+
+
+def _with_date_filter(query, date_from, date_to):
+    """Тело OLAP-запроса с фильтром по дате [date_from, date_to)"""
+    filters = dict(query.get('filters') or {})
+    filters['OpenDate.Typed'] = {
+        'filterType': 'DateRange',
+        'periodType': 'CUSTOM',
+        'from': date_from.strftime('%Y-%m-%d'),
+        'to': date_to.strftime('%Y-%m-%d'),
+        'includeLow': True,
+        'includeHigh': False,
+    }
+    return dict(query, filters=filters)
+
+
+def _safe_file_name(name):
+    """Имя файла без символов, недопустимых в Windows (двоеточие порта, olap:<хэш>)"""
+    return "".join("_" if char in '<>:"/\\|?*' else char for char in name)
+
+
+def _raise_failed(results):
+    """Первая ошибка среди результатов частей периода"""
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def _days_between(date_from, date_to):
+    """Список дней периода включительно"""
+    if isinstance(date_from, datetime):
+        date_from = date_from.date()
+    if isinstance(date_to, datetime):
+        date_to = date_to.date()
+    return [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+
+
+def _contiguous_ranges(days):
+    """Группировка отсортированных дней в непрерывные отрезки"""
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][-1] == timedelta(days=1):
+            ranges[-1].append(day)
+        else:
+            ranges.append([day])
+    return ranges
+
+
+def _split_chunks(days, chunk_days):
+    """Разбиение списка дней на части: по chunk_days дней или по календарным месяцам ('month')"""
+    if not days:
+        return []
+    if not chunk_days:
+        return [days]
+    if chunk_days == 'month':
+        chunks = []
+        for day in days:
+            if chunks and (chunks[-1][-1].year, chunks[-1][-1].month) == (day.year, day.month) \
+                    and day - chunks[-1][-1] == timedelta(days=1):
+                chunks[-1].append(day)
+            else:
+                chunks.append([day])
+        return chunks
+    return [days[i:i + chunk_days] for i in range(0, len(days), chunk_days)]
+
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
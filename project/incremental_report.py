@@ -0,0 +1,88 @@
+# incremental_report.py — дополнение ранее сформированного отчета новыми днями
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from data_fetcher import fetch_bases
+from olap_cache import day_closed_at
+from periods import as_date
+from report_generator import ReportGenerator, REPORTS_DIR, read_report_info
+
+
+def find_previous_report(reports_dir, bases, start_date, end_date, selected_sheets, report_path=None):
+    """Последний отчет с теми же базами, периодом и листами: (путь, сведения) или (None, None).
+
+    Отчеты ищутся среди всех .xlsx папки по свойству iiko_report, а не по
+    имени файла; с report_path (явно заданный файл отчета) проверяется
+    только он. Отчеты, в которых не хватает данных упавших баз
+    (failed_bases), не подходят: их дни до даты формирования так и
+    остались бы нулями.
+    """
+    if report_path is not None:
+        reports = [Path(report_path)] if Path(report_path).is_file() else []
+    else:
+        reports = sorted(Path(reports_dir).glob("*.xlsx"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in reports:
+        info = read_report_info(path)
+        if not info:
+            continue
+        if (info.get('bases') == list(bases)
+                and not info.get('failed_bases')
+                and info.get('start') == as_date(start_date).isoformat()
+                and info.get('end') == as_date(end_date).isoformat()
+                and info.get('sheets') == sorted(selected_sheets)):
+            return path, info
+    return None, None
+
+
+def refresh_start(info, start_date):
+    """Первый день, который нужно загрузить заново.
+
+    Дни, закрытые до формирования отчета (по правилу кэша OLAP: полночь +
+    CLOSED_DAY_DELAY), уже не менялись; первый день, закрытый позже, и все
+    следующие перезагружаются. В старых отчетах generated — только дата
+    (считается полночью).
+    """
+    generated = datetime.fromisoformat(info['generated']).timestamp()
+    day = as_date(start_date)
+    while day_closed_at(day) <= generated:
+        day += timedelta(days=1)
+    return day
+
+
+def refresh_report(bases_config, base_names, start_date, end_date, selected_sheets,
+                   reports_dir=REPORTS_DIR, log=print, job=None, report_path=None, **fetch_options):
+    """Дополнение последнего подходящего отчета (или файла report_path).
+
+    Возвращает путь к обновленному отчету или None, если отчета нет или его
+    нужно сформировать заново (например, появились новые кассы).
+    """
+    path, info = find_previous_report(reports_dir, base_names, start_date, end_date, selected_sheets, report_path)
+    if path is None:
+        log("ℹ️ Подходящий отчет для дополнения не найден")
+        return None
+
+    refresh_from = refresh_start(info, start_date)
+    end_date = as_date(end_date)
+    if refresh_from > end_date:
+        log(f"✅ Отчет {path} уже содержит все дни периода")
+        return path
+
+    log(f"🔄 Дополняем отчет {path} с {refresh_from:%d.%m.%Y}")
+    results = []
+    olap_data = fetch_bases(
+        bases_config, base_names, refresh_from, end_date, log=log, job=job, results=results, **fetch_options
+    )
+    if any(result.failed for result in results):
+        # иначе дни упавшей базы записались бы нулями и больше не обновлялись
+        log("⚠️ Не все базы загружены, отчет не дополняется")
+        return None
+
+    new_stores = set(olap_data.stores()) - set(info['stores'])
+    if new_stores:
+        log(f"⚠️ Появились новые кассы ({', '.join(sorted(map(str, new_stores)))}), отчет формируется заново")
+        return None
+
+    generator = ReportGenerator(log_callback=log, job=job)
+    if generator.update_excel_report(path, olap_data, None, refresh_from, info):
+        return path
+    return None
@@ -0,0 +1,162 @@
+# instrumentation.py — замеры времени этапов и счетчики одного запуска отчета
+
+import cProfile
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+_active_run = None
+
+
+class RunMetrics:
+    """Замеры одного запуска: время этапов (span) и счетчики строк/байт.
+
+    Этапы с одинаковым именем (например, запросы частей периода из разных
+    потоков) суммируются: число вызовов, общее, минимальное и максимальное
+    время. Пока запуск активен (start_run/run_metrics), span() и count()
+    из любых потоков пишут в него; без активного запуска они ничего не делают.
+    """
+
+    def __init__(self, name="report"):
+        self.name = name
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.finished = None
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                self.spans[name] = {'count': 1, 'total': seconds, 'min': seconds, 'max': seconds}
+            else:
+                stats['count'] += 1
+                stats['total'] += seconds
+                stats['min'] = min(stats['min'], seconds)
+                stats['max'] = max(stats['max'], seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        """Сводка запуска в виде словаря (для JSON)"""
+        with self._lock:
+            spans = {name: dict(stats) for name, stats in self.spans.items()}
+            counters = dict(self.counters)
+        return {
+            'run': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'elapsed': round(self.elapsed, 4),
+            'spans': {
+                name: {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+                for name, stats in sorted(spans.items())
+            },
+            'counters': dict(sorted(counters.items())),
+        }
+
+    def format_table(self):
+        """Сводка в виде текстовой таблицы для лога"""
+        summary = self.summary()
+        lines = [f"{'Этап':<32}{'вызовов':>9}{'всего, с':>11}{'макс, с':>10}"]
+        for name, stats in summary['spans'].items():
+            lines.append(f"{name:<32}{stats['count']:>9}{stats['total']:>11.3f}{stats['max']:>10.3f}")
+        lines.append(f"{'итого':<32}{'':>9}{summary['elapsed']:>11.3f}")
+        for name, value in summary['counters'].items():
+            lines.append(f"{name:<32}{value:>9}")
+        return "\n".join(lines)
+
+    def export(self, path):
+        """Запись сводки в .json или .csv (по расширению файла)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        if path.suffix.lower() == '.csv':
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['run', 'started_at', 'kind', 'name', 'count', 'total', 'min', 'max'])
+                for name, stats in summary['spans'].items():
+                    writer.writerow([self.name, summary['started_at'], 'span', name,
+                                     stats['count'], stats['total'], stats['min'], stats['max']])
+                for name, value in summary['counters'].items():
+                    writer.writerow([self.name, summary['started_at'], 'counter', name, value, '', '', ''])
+                writer.writerow([self.name, summary['started_at'], 'span', 'run', 1,
+                                 summary['elapsed'], summary['elapsed'], summary['elapsed']])
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+        return path
+
+
+def start_run(name="report"):
+    """Начало запуска: дальнейшие span()/count() пишутся в возвращаемый RunMetrics"""
+    global _active_run
+    _active_run = RunMetrics(name)
+    return _active_run
+
+
+def finish_run(run):
+    global _active_run
+    run.finished = time.perf_counter()
+    if _active_run is run:
+        _active_run = None
+    return run
+
+
+@contextmanager
+def run_metrics(name="report", profile_path=None):
+    """Запуск с замерами; при profile_path поток запуска профилируется cProfile.
+
+    Профиль (.prof, открывается pstats/snakeviz) охватывает только поток,
+    в котором выполняется блок: работа пулов потоков в нем видна как ожидание.
+    """
+    run = start_run(name)
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield run
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            Path(profile_path).parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(profile_path))
+        finish_run(run)
+
+
+@contextmanager
+def span(name):
+    """Замер времени этапа в активном запуске"""
+    run = _active_run
+    if run is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add_time(name, time.perf_counter() - started)
+
+
+def add_time(name, seconds):
+    """Добавление уже измеренного времени (например, суммы по порциям ответа)"""
+    run = _active_run
+    if run is not None:
+        run.add_time(name, seconds)
+
+
+def count(name, value=1):
+    """Увеличение счетчика активного запуска"""
+    run = _active_run
+    if run is not None:
+        run.count(name, value)
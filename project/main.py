@@ -1,11 +1,64 @@
 # main.py
+import time
+STARTED = time.perf_counter()  # отсчет времени запуска — до импорта остальных модулей
+
+import argparse
+import json
+import multiprocessing
 import tkinter as tk
+from datetime import datetime
 from app_gui import IikoReportApp # Импортируем класс GUI
 
-def main():
+IMPORTED = time.perf_counter()
+WARMUP_WAIT_MS = 100  # период проверки окончания фонового прогрева в режиме замера
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Получение данных из iiko")
+    parser.add_argument("--startup-time", nargs="?", const="", metavar="ФАЙЛ",
+                        help="замерить время запуска до готового окна, вывести его и выйти; "
+                             "с ФАЙЛОМ замер дописывается в него строкой JSON")
+    # неизвестные аргументы (например, от PyInstaller) не мешают запуску
+    return parser.parse_known_args(argv)[0]
+
+
+def main(argv=None):
+    args = parse_args(argv)
     root = tk.Tk()
     app = IikoReportApp(root) # Создаем экземпляр GUI
+    # первая свободная итерация главного цикла после отрисовки окна — окно отвечает пользователю
+    root.after(0, lambda: root.after_idle(report_startup, root, app, args.startup_time))
     root.mainloop()          # Запускаем главный цикл событий
 
+
+def report_startup(root, app, startup_path):
+    """Запись времени запуска в лог; в режиме --startup-time — вывод, сохранение и выход"""
+    interactive = time.perf_counter() - STARTED
+    app.log_message(f"🚀 Окно готово за {interactive:.2f} с (импорт модулей {IMPORTED - STARTED:.2f} с)")
+    if startup_path is None:
+        return
+
+    def finish():
+        # прогрев не задерживает окно, но его длительность тоже отслеживаем
+        if app.warmup_time is None:
+            root.after(WARMUP_WAIT_MS, finish)
+            return
+        result = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'imports': round(IMPORTED - STARTED, 3),
+            'interactive': round(interactive, 3),
+            'warmup': round(app.warmup_time, 3),
+        }
+        print(f"Импорт: {result['imports']:.3f} с, окно готово: {result['interactive']:.3f} с, "
+              f"фоновый прогрев: {result['warmup']:.3f} с")
+        if startup_path:
+            with open(startup_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        root.destroy()
+
+    finish()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    multiprocessing.freeze_support() # процессы записи отчетов в собранном PyInstaller exe
+    main()
@@ -0,0 +1,186 @@
+# mock_iiko_server.py — локальный сервер, имитирующий API iiko, для замеров и отладки без ресторанов
+#
+# Запуск отдельно:
+#   python mock_iiko_server.py --port 8080 --stores 20 --rows-per-day 3
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+OLAP_PATH = "/v2/reports/olap/byPresetId/"
+OLAP_QUERY_PATH = "/v2/reports/olap"
+DAY_NAMES = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+
+class MockIikoServer:
+    """Сервер с ответами /auth, /logout, /v2/reports/olap/byPresetId/{id} и /v2/reports/olap.
+
+    На каждый день периода и кассу отдается rows_per_day строк OLAP со
+    случайными, но воспроизводимыми (по кассе и дню) показателями и планами.
+    OLAP-запрос (POST) группирует те же строки по groupByRowFields и
+    суммирует aggregateFields за период фильтра OpenDate.Typed.
+    latency — задержка перед ответом в секундах, имитирующая работу сервера.
+    """
+
+    def __init__(self, stores=5, rows_per_day=1, latency=0.0, name="Mock", host="127.0.0.1", port=0):
+        self.stores = [f"{name} касса {index + 1}" for index in range(stores)]
+        self.rows_per_day = rows_per_day
+        self.latency = latency
+        self.requests = {'auth': 0, 'olap': 0, 'olap_query': 0, 'logout': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler_class(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count_request(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def olap_rows(self, date_from, date_to):
+        """Строки отчета за дни [date_from, date_to) — как dateTo в iiko, не включая"""
+        rows = []
+        day = date_from
+        while day < date_to:
+            for store in self.stores:
+                rng = random.Random(f"{store}|{day.isoformat()}")
+                for _ in range(self.rows_per_day):
+                    guests = rng.randint(20, 120)
+                    dishes = guests * rng.randint(2, 5)
+                    rows.append({
+                        'OpenDate.Typed': day.isoformat(),
+                        'DayOfWeekOpen': f"{day.isoweekday()}. {DAY_NAMES[day.weekday()]}",
+                        'Store.Name': store,
+                        'DishDiscountSumInt': dishes * rng.randint(150, 600),
+                        'DishAmountInt': dishes,
+                        'GuestNum': guests,
+                        'PlanValue': rng.randint(30, 80) * 1000,
+                        'PlanOccupancy': round(rng.uniform(2, 5), 2),
+                        'PlanDishPrice': rng.randint(200, 500),
+                        'PlanGuestFlow': rng.randint(40, 100),
+                    })
+            day += timedelta(days=1)
+        return rows
+
+    def olap_query_rows(self, query):
+        """Ответ на OLAP-запрос: суммы aggregateFields по groupByRowFields"""
+        period = query['filters']['OpenDate.Typed']
+        date_from = date.fromisoformat(period['from'][:10])
+        date_to = date.fromisoformat(period['to'][:10])
+        if period.get('includeHigh'):
+            date_to += timedelta(days=1)
+        group_fields = query.get('groupByRowFields', [])
+        aggregate_fields = query.get('aggregateFields', [])
+        groups = {}
+        for row in self.olap_rows(date_from, date_to):
+            key = tuple(row.get(field) for field in group_fields)
+            sums = groups.setdefault(key, dict.fromkeys(aggregate_fields, 0))
+            for field in aggregate_fields:
+                sums[field] += row.get(field, 0)
+        return [dict(zip(group_fields, key), **sums) for key, sums in groups.items()]
+
+
+def _handler_class(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="text/plain"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            url = urlparse(self.path)
+            if url.path == OLAP_QUERY_PATH:
+                return self._olap_query(url, body)
+            if url.path != "/auth":
+                return self._send(404)
+            mock.count_request('auth')
+            self._send(200, b"mock-token")
+
+        def _olap_query(self, url, body):
+            if not parse_qs(url.query).get('key'):
+                return self._send(401)
+            mock.count_request('olap_query')
+            try:
+                rows = mock.olap_query_rows(json.loads(body))
+            except (KeyError, TypeError, ValueError):
+                return self._send(400)
+            if mock.latency:
+                time.sleep(mock.latency)
+            self._send(200, json.dumps({'data': rows}, ensure_ascii=False).encode(), "application/json")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/logout":
+                mock.count_request('logout')
+                return self._send(200)
+            if not url.path.startswith(OLAP_PATH):
+                return self._send(404)
+            if not query.get('key'):
+                return self._send(401)
+            mock.count_request('olap')
+            try:
+                date_from = date.fromisoformat(query['dateFrom'][0])
+                date_to = date.fromisoformat(query['dateTo'][0])
+            except (KeyError, ValueError):
+                return self._send(400)
+            if mock.latency:
+                time.sleep(mock.latency)
+            body = json.dumps({'data': mock.olap_rows(date_from, date_to)}, ensure_ascii=False).encode()
+            self._send(200, body, "application/json")
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная имитация API iiko")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--rows-per-day", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    server = MockIikoServer(args.stores, args.rows_per_day, args.latency, port=args.port)
+    print(f"Сервер iiko (имитация): {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
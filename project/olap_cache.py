@@ -0,0 +1,219 @@
+# olap_cache.py — дисковый кэш ответов OLAP по дням
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from periods import as_date
+
+CACHE_DIR = Path.home() / ".iiko_report_cache"
+CACHE_TTL = 30 * 24 * 3600          # сколько секунд хранится закрытый день
+CACHE_MAX_SIZE = 500 * 1024 * 1024  # предельный размер кэша в байтах
+CLOSED_DAY_DELAY = 4 * 3600         # секунд после полуночи, когда день считается закрытым (смены после полуночи)
+EVICT_INTERVAL = 10 * 60            # секунд между полными проходами вытеснения, если размер в пределах
+EVICT_TARGET = 0.9                  # до какой доли max_size вытеснять, чтобы следующие записи не запускали проход
+EVICT_LOCK = ".evict.lock"          # файл блокировки вытеснения: кэш общий для нескольких процессов
+STALE_LOCK_AGE = 10 * 60            # секунд, после которых блокировка (и недописанный .tmp) считаются брошенными
+OPEN_DAY_TTL = 15 * 60              # секунд, сколько отчеты берут текущий день из кэша (его обновляет prefetch_service)
+
+
+def day_closed_at(day):
+    """Момент (timestamp), после которого данные дня больше не меняются: полночь + CLOSED_DAY_DELAY"""
+    return datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp() + CLOSED_DAY_DELAY
+
+
+def row_day(row):
+    """Дата строки OLAP в формате YYYY-MM-DD или None"""
+    value = row.get('OpenDate.Typed')
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    return value[:10]
+
+
+class OlapCache:
+    """Кэш строк OLAP-отчета с ключом (base_url, preset_id, день).
+
+    Закрытые (прошедшие) дни не меняются, поэтому хранятся до истечения ttl.
+    Текущий день кэшируется только при open_day_ttl > 0 и на это время.
+    День, загруженный до своего закрытия (полночь + CLOSED_DAY_DELAY), мог
+    быть неполным, поэтому и потом живет только open_day_ttl.
+    При превышении max_size удаляются давно не использованные дни. Каталог
+    кэша обходится не после каждой записи: размер ведется по записанным
+    файлам, полный проход — когда он превысил max_size или раз в EVICT_INTERVAL.
+    Каталогом могут одновременно пользоваться несколько процессов (GUI,
+    cli.py, prefetch_service): временные файлы у каждой записи свои, а
+    вытесняет один процесс за раз.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE, open_day_ttl=0):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.open_day_ttl = open_day_ttl
+        self._lock = threading.Lock()
+        self._size = None     # размер кэша по последнему проходу и записям после него
+        self._evicted_at = 0.0
+
+    def _day_path(self, base_url, preset_id, day):
+        key = hashlib.sha1(f"{base_url.strip()}|{preset_id}".encode()).hexdigest()
+        return self.cache_dir / key / f"{day.isoformat()}.json"
+
+    def is_cacheable(self, day):
+        """Можно ли сохранять день в кэш"""
+        today = date.today()
+        if day < today:
+            return True
+        return day == today and self.open_day_ttl > 0
+
+    def _entry_ttl(self, day, fetched_at):
+        if day < date.today() and fetched_at >= day_closed_at(day):
+            return self.ttl
+        return self.open_day_ttl
+
+    def get_day(self, base_url, preset_id, day):
+        """Строки за день из кэша или None, если дня нет или он устарел"""
+        day = as_date(day)
+        if not self.is_cacheable(day):
+            return None
+        path = self._day_path(base_url, preset_id, day)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        fetched_at = entry.get('fetched_at', 0)
+        if time.time() - fetched_at > self._entry_ttl(day, fetched_at):
+            return None
+        try:
+            os.utime(path)  # отметка использования для вытеснения
+        except OSError:
+            pass
+        return entry.get('rows', [])
+
+    def put_day(self, base_url, preset_id, day, rows):
+        """Сохранение строк за день"""
+        day = as_date(day)
+        if not self.is_cacheable(day):
+            return
+        path = self._day_path(base_url, preset_id, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        old_size = _file_size(path)
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': time.time(), 'rows': rows}, f, ensure_ascii=False)
+                size = f.tell()
+            os.replace(tmp_name, path)
+        except BaseException:
+            _unlink(Path(tmp_name))
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += size - old_size
+
+    def put_days(self, base_url, preset_id, days, rows):
+        """Раскладка строк ответа по дням и сохранение всех дней периода"""
+        by_day = {day.isoformat(): [] for day in days}
+        for row in rows:
+            key = row_day(row)
+            if key in by_day:
+                by_day[key].append(row)
+        for day in days:
+            self.put_day(base_url, preset_id, day, by_day[day.isoformat()])
+        self.evict_if_needed()
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            for path in self.cache_dir.glob('*/*.json'):
+                _unlink(path)
+            self._size = 0
+
+    def evict_if_needed(self):
+        """Вытеснение, если кэш вырос больше max_size или давно не проверялся"""
+        with self._lock:
+            due = (self._size is None or self._size > self.max_size
+                   or time.monotonic() - self._evicted_at > EVICT_INTERVAL)
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Удаление устаревших дней и вытеснение по размеру.
+
+        Если другой процесс уже вытесняет (файл EVICT_LOCK), проход пропускается.
+        """
+        with self._lock:
+            lock_path = self.cache_dir / EVICT_LOCK
+            if not _acquire_lock(lock_path):
+                return
+            try:
+                self._evict()
+            finally:
+                _unlink(lock_path)
+
+    def _evict(self):
+        files = []
+        now = time.time()
+        for path in self.cache_dir.glob('*/*.tmp'):
+            # недописанные файлы упавших процессов
+            try:
+                if now - path.stat().st_mtime > STALE_LOCK_AGE:
+                    _unlink(path)
+            except OSError:
+                pass
+        for path in self.cache_dir.glob('*/*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                _unlink(path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_size:
+            for _, size, path in sorted(files):
+                _unlink(path)
+                total -= size
+                if total <= self.max_size * EVICT_TARGET:
+                    break
+        self._size = total
+        self._evicted_at = time.monotonic()
+
+
+def _acquire_lock(path):
+    """Файл блокировки, созданный атомарно; брошенная блокировка (старше STALE_LOCK_AGE) снимается"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime <= STALE_LOCK_AGE:
+                    return False
+            except OSError:
+                continue
+            _unlink(path)
+        except OSError:
+            return False
+    return False
+
+
+def _file_size(path):
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except OSError:
+        pass
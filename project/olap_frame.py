@@ -0,0 +1,231 @@
+# olap_frame.py — компактное колоночное хранилище строк OLAP между загрузкой и отчетом
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+DATE_FIELD = 'OpenDate.Typed'
+CATEGORY_FIELDS = ('BaseName', 'Store.Name', 'DayOfWeekOpen')
+FACT_FIELDS = ('DishDiscountSumInt', 'DishAmountInt', 'GuestNum')
+PLAN_FIELDS = ('PlanValue', 'PlanOccupancy', 'PlanDishPrice', 'PlanGuestFlow')
+AVERAGE_FIELDS = ('BaseName', 'Store.Name', DATE_FIELD, *FACT_FIELDS)
+
+
+class OlapFrame:
+    """Строки отчетов всех баз в типизированных колонках.
+
+    rows — основные строки (план и факт), average — строки пресета средних
+    показателей. Названия баз, касс и дней недели хранятся как категории,
+    даты — datetime64, показатели — float64. Если пресет средних совпадает
+    с основным, average ссылается на тот же DataFrame, а не на копию.
+    fact_bases — базы, факт которых (и выручка тоже) получен OLAP-запросом
+    и берется только из average. Сохраняется в .npz (без дополнительных
+    зависимостей), .parquet или .feather (нужен pyarrow).
+    """
+
+    def __init__(self, rows=None, average=None, fact_bases=()):
+        self.rows = rows if rows is not None else _typed_frame([], None)
+        self.average = average if average is not None else self.rows
+        self.fact_bases = frozenset(fact_bases)
+
+    @classmethod
+    def from_base(cls, base_name, data, avg_data=None, olap_facts=False):
+        """Кадр одной базы из ответов OLAP ({"data": [...]}); строки-словари дальше не нужны.
+
+        olap_facts — avg_data получен OLAP-запросом факта (FACT_QUERY).
+        """
+        rows = _typed_frame(_response_rows(data), base_name)
+        if avg_data is None or avg_data is data:
+            return cls(rows)
+        average = _typed_frame(_response_rows(avg_data), base_name, AVERAGE_FIELDS)
+        return cls(rows, average, [base_name] if olap_facts else ())
+
+    @classmethod
+    def from_rows(cls, all_data, average_data_dict=None):
+        """Кадр из прежнего представления: список строк и словарь база -> строки средних"""
+        rows = _typed_frame(all_data, None)
+        if average_data_dict is None:
+            return cls(rows)
+        average = [
+            _typed_frame(avg_rows, base_name, AVERAGE_FIELDS)
+            for base_name, avg_rows in average_data_dict.items()
+        ]
+        return cls(rows, _concat(average) if average else _typed_frame([], None, AVERAGE_FIELDS))
+
+    @classmethod
+    def concat(cls, frames):
+        """Объединение кадров по порядку (например, баз в порядке выбора)"""
+        frames = list(frames)
+        if not frames:
+            return cls()
+        rows = _concat([frame.rows for frame in frames])
+        if all(frame.shared_average for frame in frames):
+            return cls(rows)
+        fact_bases = set().union(*(frame.fact_bases for frame in frames))
+        return cls(rows, _concat([frame.average[list(AVERAGE_FIELDS)] for frame in frames]), fact_bases)
+
+    @property
+    def shared_average(self):
+        return self.average is self.rows
+
+    @property
+    def empty(self):
+        return self.rows.empty
+
+    def __len__(self):
+        return len(self.rows)
+
+    def stores(self):
+        """Названия касс в порядке первого появления"""
+        return [str(name) for name in self.rows['Store.Name'].dropna().unique()]
+
+    def base_names(self):
+        return [str(name) for name in self.average['BaseName'].dropna().unique()]
+
+    def select_bases(self, base_names):
+        """Строки только указанных баз"""
+        rows = self.rows[self.rows['BaseName'].isin(base_names)]
+        if self.shared_average:
+            return OlapFrame(rows)
+        return OlapFrame(rows, self.average[self.average['BaseName'].isin(base_names)],
+                         self.fact_bases.intersection(base_names))
+
+    def slice(self, start_date, end_date):
+        """Строки за период включительно"""
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        rows = self.rows[self.rows[DATE_FIELD].between(start, end)]
+        if self.shared_average:
+            return OlapFrame(rows)
+        return OlapFrame(rows, self.average[self.average[DATE_FIELD].between(start, end)], self.fact_bases)
+
+    def save(self, path):
+        """Сохранение в .npz, .parquet или .feather (по расширению файла)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        suffix = path.suffix.lower()
+        if suffix in ('.parquet', '.feather'):
+            # оба формата пишутся одной таблицей: строки средних помечены колонкой Average,
+            # строки факта из OLAP-запроса — еще и колонкой OlapFacts
+            table = self.rows.assign(Average=False, OlapFacts=False)
+            if not self.shared_average:
+                olap_facts = self.average['BaseName'].astype(object).isin(self.fact_bases)
+                table = pd.concat([table, self.average.assign(Average=True, OlapFacts=olap_facts)],
+                                  ignore_index=True)
+            if suffix == '.parquet':
+                table.to_parquet(path, index=False)
+            else:
+                table.to_feather(path)
+            return path
+
+        if suffix != '.npz':
+            path = path.with_suffix('.npz')
+        arrays = {'shared_average': np.array(self.shared_average),
+                  'fact_bases': np.array(sorted(self.fact_bases), dtype=str)}
+        arrays.update(_frame_arrays('rows', self.rows))
+        if not self.shared_average:
+            arrays.update(_frame_arrays('average', self.average))
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix in ('.parquet', '.feather'):
+            table = pd.read_parquet(path) if suffix == '.parquet' else pd.read_feather(path)
+            is_average = table.pop('Average').astype(bool)
+            olap_facts = (table.pop('OlapFacts').astype(bool) if 'OlapFacts' in table.columns
+                          else pd.Series(False, index=table.index))
+            rows = _typed_frame(table[~is_average], None)
+            if not is_average.any():
+                return cls(rows)
+            fact_bases = table.loc[olap_facts, 'BaseName'].astype(str).unique()
+            return cls(rows, _typed_frame(table[is_average], None, AVERAGE_FIELDS), fact_bases)
+
+        with np.load(path, allow_pickle=False) as arrays:
+            rows = _arrays_frame('rows', arrays)
+            if bool(arrays['shared_average']):
+                return cls(rows)
+            fact_bases = arrays['fact_bases'].tolist() if 'fact_bases' in arrays else ()
+            return cls(rows, _arrays_frame('average', arrays), fact_bases)
+
+
+def _response_rows(response):
+    if not response:
+        return []
+    return response.get('data', [])
+
+
+def _typed_frame(rows, base_name, fields=None):
+    """Типизированный кадр из строк-словарей или кадра с теми же колонками"""
+    source = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    fields = fields or ('BaseName', 'Store.Name', DATE_FIELD, 'DayOfWeekOpen', *FACT_FIELDS, *PLAN_FIELDS)
+    frame = pd.DataFrame(index=range(len(source)))
+    for field in fields:
+        values = source[field].to_numpy() if field in source.columns else None
+        if field == 'BaseName' and base_name is not None:
+            frame[field] = pd.Categorical([base_name] * len(source))
+        elif field == DATE_FIELD:
+            frame[field] = _dates(values, len(source))
+        elif field in CATEGORY_FIELDS:
+            frame[field] = pd.Categorical(values if values is not None else [None] * len(source))
+        elif values is not None:
+            frame[field] = pd.to_numeric(pd.Series(values), errors='coerce').astype('float64').to_numpy()
+    # строки без даты нельзя отнести ни к одному дню отчета
+    return frame[frame[DATE_FIELD].notna()].reset_index(drop=True)
+
+
+def _dates(values, length):
+    if values is None:
+        return pd.Series(pd.NaT, index=range(length), dtype='datetime64[ns]')
+    if np.issubdtype(np.asarray(values).dtype, np.datetime64):
+        return pd.to_datetime(values).normalize()
+    # OpenDate.Typed приходит строкой "YYYY-MM-DD..."; остальное считаем пропуском
+    days = [value[:10] if isinstance(value, str) else None for value in values]
+    return pd.to_datetime(pd.Series(days), format='%Y-%m-%d', errors='coerce').astype('datetime64[ns]')
+
+
+def _concat(frames):
+    """Склейка кадров с объединением категорий (а не откатом к object)"""
+    frames = [frame for frame in frames if not frame.empty] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    result = pd.concat(frames, ignore_index=True)
+    for field in CATEGORY_FIELDS:
+        if field in result.columns and not isinstance(result[field].dtype, pd.CategoricalDtype):
+            result[field] = pd.Categorical(result[field])
+    return result
+
+
+def _frame_arrays(prefix, frame):
+    """Колонки кадра в массивы numpy без pickle: категории — коды и словарь"""
+    arrays = {f"{prefix}.columns": np.array(frame.columns, dtype=str)}
+    for field in frame.columns:
+        column = frame[field]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays[f"{prefix}.{field}.codes"] = column.cat.codes.to_numpy()
+            arrays[f"{prefix}.{field}.categories"] = np.array(column.cat.categories.astype(str), dtype=str)
+        else:
+            arrays[f"{prefix}.{field}"] = column.to_numpy()
+    return arrays
+
+
+def _arrays_frame(prefix, arrays):
+    columns = {}
+    for field in arrays[f"{prefix}.columns"].tolist():
+        if f"{prefix}.{field}.codes" in arrays:
+            columns[field] = pd.Categorical.from_codes(
+                arrays[f"{prefix}.{field}.codes"], arrays[f"{prefix}.{field}.categories"].tolist()
+            )
+        else:
+            columns[field] = arrays[f"{prefix}.{field}"]
+    return pd.DataFrame(columns)
+
+
+def as_olap_frame(all_data, average_data_dict=None):
+    """OlapFrame как есть или из списка строк-словарей"""
+    if isinstance(all_data, OlapFrame):
+        return all_data
+    return OlapFrame.from_rows(all_data or [], average_data_dict)
+
@@ -0,0 +1,154 @@
+# olap_stream.py — потоковый разбор JSON-ответа OLAP
+
+import codecs
+import json
+import sys
+
+INTERN_MAX_LENGTH = 64  # строки-значения не длиннее этого интернируются (кассы, даты, дни недели)
+
+_WHITESPACE = ' \t\n\r'
+
+
+class OlapParseError(ValueError):
+    """Ответ OLAP оборван или не является корректным JSON"""
+
+
+def _compact_row(pairs, intern=sys.intern):
+    """Строка отчета с общими для всех строк ключами и повторяющимися значениями"""
+    return {
+        intern(key): intern(value) if value.__class__ is str and len(value) <= INTERN_MAX_LENGTH else value
+        for key, value in pairs
+    }
+
+
+class OlapStreamParser:
+    """Инкрементальный разбор ответа вида {"data": [{...}, ...], ...}.
+
+    Байты подаются через feed() по мере скачивания, строки массива "data"
+    разбираются сразу, а текст ответа целиком в памяти не хранится —
+    только недоразобранный хвост. Ключи и короткие строковые значения
+    интернируются, поэтому одинаковые названия касс и даты во всех строках
+    занимают память один раз. Прочие поля верхнего уровня сохраняются как есть.
+    """
+
+    def __init__(self, array_key='data'):
+        self.array_key = array_key
+        self.result = {}
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._row_decoder = json.JSONDecoder(object_pairs_hook=_compact_row)
+        self._value_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._state = 'start'
+        self._key = None
+        self._rows = None
+
+    def feed(self, data, final=False):
+        """Разбор очередной порции байт ответа; OlapParseError при некорректных данных"""
+        try:
+            self._buffer += self._decoder.decode(data, final)
+            pos = self._parse(final)
+        except OlapParseError:
+            raise
+        except ValueError as e:  # ошибки json и UTF-8
+            raise OlapParseError(f"Некорректный JSON в ответе OLAP: {e}") from e
+        self._buffer = self._buffer[pos:]
+
+    def close(self):
+        """Завершение разбора; OlapParseError, если ответ оборван или некорректен"""
+        self.feed(b'', final=True)
+        if self._state != 'done' or self._buffer.strip():
+            raise OlapParseError("Неполный или некорректный JSON в ответе OLAP")
+        return self.result
+
+    def _skip(self, pos):
+        buffer = self._buffer
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def _decode(self, decoder, pos, final):
+        """Значение с позиции pos и позиция за ним или None, если данных пока не хватает.
+
+        Значение в самом конце буфера принимается только при final:
+        число "12" может оказаться началом "125".
+        """
+        try:
+            value, end = decoder.raw_decode(self._buffer, pos)
+        except ValueError:
+            if final:
+                raise
+            return None
+        if end >= len(self._buffer) and not final:
+            return None
+        return value, end
+
+    def _parse(self, final):
+        buffer = self._buffer
+        pos = 0
+        batch = True
+        while True:
+            pos = self._skip(pos)
+            if pos >= len(buffer):
+                return pos
+            char = buffer[pos]
+
+            if self._state == 'start':
+                if char != '{':
+                    raise OlapParseError("Ответ OLAP не является JSON-объектом")
+                self._state = 'key'
+                pos += 1
+            elif self._state == 'key':
+                if char == '}':
+                    self._state = 'done'
+                    return pos + 1
+                if char == ',':
+                    pos += 1
+                    continue
+                decoded = self._decode(self._value_decoder, pos, final)
+                if decoded is None:
+                    return pos
+                self._key, pos = decoded
+                self._state = 'colon'
+            elif self._state == 'colon':
+                if char != ':':
+                    raise OlapParseError("Ожидалось ':' в ответе OLAP")
+                self._state = 'value'
+                pos += 1
+            elif self._state == 'value':
+                if self._key == self.array_key and char == '[':
+                    self._rows = self.result.setdefault(self.array_key, [])
+                    self._state = 'rows'
+                    pos += 1
+                    continue
+                decoded = self._decode(self._value_decoder, pos, final)
+                if decoded is None:
+                    return pos
+                self.result[self._key], pos = decoded
+                self._state = 'key'
+            elif self._state == 'rows':
+                if char == ']':
+                    self._state = 'key'
+                    pos += 1
+                    continue
+                if char == ',':
+                    pos += 1
+                    continue
+                if batch:
+                    # все полные строки буфера одним вызовом декодера; если последняя
+                    # '}' оказалась не концом строки, массив не разберется — тогда по одной
+                    cut = buffer.rfind('}', pos)
+                    if cut > pos:
+                        try:
+                            self._rows.extend(self._row_decoder.decode(f"[{buffer[pos:cut + 1]}]"))
+                            pos = cut + 1
+                            continue
+                        except ValueError:
+                            pass
+                    batch = False
+                decoded = self._decode(self._row_decoder, pos, final)
+                if decoded is None:
+                    return pos
+                row, pos = decoded
+                self._rows.append(row)
+            else:
+                return pos
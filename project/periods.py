@@ -0,0 +1,59 @@
+# periods.py — предустановленные периоды отчета
+
+import calendar
+from datetime import datetime, timedelta
+
+PERIOD_PRESETS = ["Сегодня", "Вчера", "Текущая неделя", "Прошлая неделя", "Текущий месяц",
+                  "Прошлый месяц", "Текущий год", "Прошлый год", "Другой..."]
+
+# латинские имена периодов для командной строки
+PERIOD_ALIASES = {
+    "today": "Сегодня",
+    "yesterday": "Вчера",
+    "this-week": "Текущая неделя",
+    "last-week": "Прошлая неделя",
+    "this-month": "Текущий месяц",
+    "last-month": "Прошлый месяц",
+    "this-year": "Текущий год",
+    "last-year": "Прошлый год",
+}
+
+
+def as_date(value):
+    """Дата без времени из date или datetime"""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def period_dates(period, today=None):
+    """Даты начала и конца периода или (None, None) для произвольного периода"""
+    period = PERIOD_ALIASES.get(period, period)
+    today = today or datetime.now()
+
+    if period == "Сегодня":
+        return today, today
+    elif period == "Вчера":
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    elif period == "Текущая неделя":
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6)
+    elif period == "Прошлая неделя":
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6)
+    elif period == "Текущий месяц":
+        start = today.replace(day=1)
+        end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+        return start, end
+    elif period == "Прошлый месяц":
+        if today.month == 1:
+            start = today.replace(year=today.year-1, month=12, day=1)
+            end = today.replace(year=today.year-1, month=12, day=31)
+        else:
+            start = today.replace(month=today.month-1, day=1)
+            end = today.replace(month=today.month-1, day=calendar.monthrange(today.year, today.month-1)[1])
+        return start, end
+    elif period == "Текущий год":
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    elif period == "Прошлый год":
+        return today.replace(year=today.year-1, month=1, day=1), today.replace(year=today.year-1, month=12, day=31)
+    return None, None
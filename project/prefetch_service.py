@@ -0,0 +1,166 @@
+# prefetch_service.py — фоновая загрузка данных iiko в кэш по расписанию
+#
+# Отчеты (GUI и cli.py) берут закрытые дни из кэша OLAP, а текущий — если он
+# загружен не раньше OPEN_DAY_TTL назад. Служба заранее наполняет этот кэш:
+# ночью догружает закрытые дни, днем каждые несколько минут обновляет текущий.
+#
+# Примеры:
+#   python prefetch_service.py --all-bases
+#   python prefetch_service.py --bases "База 1" "База 2" --closed-days 62 --today-interval 5 --nightly-at 05:00
+#   python prefetch_service.py --all-bases --once     # один проход (для планировщика заданий)
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from cli import add_bases_arguments, log_message, selected_bases
+from config import BASES_CONFIG
+from data_fetcher import DEFAULT_CACHE, fetch_base
+from iiko_collector import release_collectors
+from instrumentation import run_metrics
+
+CLOSED_DAYS = 45           # сколько прошедших дней держать в кэше (текущий и прошлый месяц)
+NIGHTLY_AT = "05:00"       # время ночной загрузки закрытых дней (после CLOSED_DAY_DELAY кэша)
+TODAY_INTERVAL = 10 * 60   # секунд между обновлениями текущего дня (меньше OPEN_DAY_TTL)
+PREFETCH_WORKERS = 4       # баз, загружаемых одновременно
+
+
+class PrefetchService:
+    """Загрузка выбранных баз в кэш OLAP по расписанию.
+
+    Запрашивается то же, что и при формировании отчета (fetch_base: пресет,
+    пресет средних или OLAP-запрос факта), поэтому отчет потом находит в
+    кэше все нужные дни. Закрытые дни за последние closed_days догружаются
+    раз в сутки в nightly_at (уже лежащие в кэше не запрашиваются), текущий
+    день перезапрашивается каждые today_interval секунд. Одновременно
+    опрашивается не больше max_workers баз; после каждого прохода токены
+    iiko освобождаются, чтобы служба не занимала слоты лицензий.
+    """
+
+    def __init__(self, bases_config, base_names=None, cache=DEFAULT_CACHE, closed_days=CLOSED_DAYS,
+                 nightly_at=NIGHTLY_AT, today_interval=TODAY_INTERVAL, max_workers=PREFETCH_WORKERS, log=print):
+        self.bases_config = bases_config
+        self.base_names = list(base_names) if base_names else list(bases_config)
+        self.cache = cache
+        self.closed_days = closed_days
+        self.nightly_at = datetime.strptime(nightly_at, "%H:%M").time()
+        self.today_interval = today_interval
+        self.max_workers = max_workers
+        self.log = log
+        self._stop = threading.Event()
+        if cache.open_day_ttl < today_interval:
+            log(f"⚠️ Текущий день хранится в кэше {cache.open_day_ttl} с — меньше интервала "
+                f"обновления {today_interval} с, отчеты часть времени будут загружать его сами")
+
+    def prefetch_closed(self):
+        """Догрузка закрытых дней за последние closed_days"""
+        today = date.today()
+        return self._prefetch("закрытые дни", today - timedelta(days=self.closed_days),
+                              today - timedelta(days=1), refresh=False)
+
+    def prefetch_today(self):
+        """Обновление текущего дня (всегда с сервера)"""
+        today = date.today()
+        return self._prefetch("текущий день", today, today, refresh=True)
+
+    def _prefetch(self, label, start_date, end_date, refresh):
+        """Один проход по базам; возвращает список баз, загрузить которые не удалось"""
+        self.log(f"🔄 Загрузка в кэш ({label}): {start_date:%d.%m.%Y} - {end_date:%d.%m.%Y}")
+        started = time.monotonic()
+
+        def fetch(base_name):
+            if self._stop.is_set():
+                return base_name, "служба остановлена"
+            try:
+                fetch_base(base_name, self.bases_config[base_name], start_date, end_date,
+                           cache=self.cache, refresh=refresh)
+                return base_name, None
+            except Exception as e:
+                return base_name, str(e)
+
+        failed = []
+        try:
+            with run_metrics("prefetch") as run, \
+                    ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(self.base_names)))) as executor:
+                for base_name, error in executor.map(fetch, self.base_names):
+                    if error is not None:
+                        self.log(f"❌ База {base_name}: {error}")
+                        failed.append(base_name)
+        finally:
+            release_collectors()
+        rows = run.summary()['counters'].get('iiko.rows', 0)
+        self.log(f"✅ Кэш обновлен ({label}) за {time.monotonic() - started:.1f} с, "
+                 f"получено строк: {rows}, без данных: {len(failed)}")
+        return failed
+
+    def next_nightly(self, now):
+        """Ближайший момент ночной загрузки после now"""
+        moment = datetime.combine(now.date(), self.nightly_at)
+        return moment if moment > now else moment + timedelta(days=1)
+
+    def run_once(self):
+        """Один проход: закрытые дни и текущий день"""
+        return self.prefetch_closed() + self.prefetch_today()
+
+    def serve_forever(self):
+        """Работа по расписанию до stop(); при запуске закрытые дни загружаются сразу"""
+        next_closed = datetime.now()
+        next_today = datetime.now()
+        while not self._stop.is_set():
+            if datetime.now() >= next_closed:
+                self.prefetch_closed()
+                next_closed = self.next_nightly(datetime.now())
+            if datetime.now() >= next_today:
+                self.prefetch_today()
+                next_today = datetime.now() + timedelta(seconds=self.today_interval)
+            wait = (min(next_closed, next_today) - datetime.now()).total_seconds()
+            self._stop.wait(max(0.0, wait))
+
+    def stop(self):
+        self._stop.set()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Фоновая загрузка данных iiko в кэш отчетов")
+    add_bases_arguments(parser)
+    parser.add_argument("--closed-days", type=int, default=CLOSED_DAYS, help="сколько прошедших дней держать в кэше")
+    parser.add_argument("--nightly-at", default=NIGHTLY_AT, metavar="ЧЧ:ММ", help="время загрузки закрытых дней")
+    parser.add_argument("--today-interval", type=float, default=TODAY_INTERVAL / 60, metavar="МИНУТ",
+                        help="как часто обновлять текущий день")
+    parser.add_argument("--workers", type=int, default=PREFETCH_WORKERS, help="баз, загружаемых одновременно")
+    parser.add_argument("--once", action="store_true", help="один проход и выход")
+    args = parser.parse_args(argv)
+    try:
+        datetime.strptime(args.nightly_at, "%H:%M")
+    except ValueError:
+        parser.error(f"неверное время: {args.nightly_at}")
+    return parser, args
+
+
+def log_service_message(message):
+    """Сообщение службы: она работает сутками, поэтому в метке есть дата"""
+    log_message(message, time_format="%d.%m %H:%M:%S")
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    base_names = selected_bases(parser, args)
+
+    service = PrefetchService(BASES_CONFIG, base_names, closed_days=args.closed_days, nightly_at=args.nightly_at,
+                              today_interval=args.today_interval * 60, max_workers=args.workers,
+                              log=log_service_message)
+    if args.once:
+        return 1 if service.run_once() else 0
+    log_service_message(f"🚀 Служба загрузки запущена: {len(base_names)} баз, текущий день каждые "
+                        f"{args.today_interval:g} мин, закрытые дни в {args.nightly_at}")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
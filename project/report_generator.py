@@ -1,228 +1,946 @@
 # report_generator.py — логика создания Excel-файлов
 
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.formatting.formatting import ConditionalFormattingList
 from openpyxl.formatting.rule import CellIsRule
+from openpyxl.packaging.custom import StringProperty
+from instrumentation import count, span
+from olap_frame import FACT_FIELDS, as_olap_frame
+from periods import as_date
+from report_job import JobCancelled
+import time
 from datetime import datetime
+from pathlib import Path
+
+HEADERS = ["День недели", "Дата", "План", "Факт", "% выполнения"]
+BASE_COLORS = {
+    0: "E2EFDA", 1: "FFEB9C", 2: "C6E0B4", 3: "FFE699",
+    4: "A9D08E", 5: "F8CBAD", 6: "9CC2E5", 7: "D9E1F2",
+}
+GREEN_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+RED_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+# листы отчета: ключ выбора в интерфейсе -> (название, поле плана, метрика)
+REPORT_SHEETS = {
+    1: ("Свод План-Факт", 'PlanValue', 'revenue'),
+    2: ("План_факт наполняемость", 'PlanOccupancy', 'occupancy'),
+    3: ("План_факт стоимость блюд", 'PlanDishPrice', 'dish_price'),
+    4: ("План_факт гостепоток", 'PlanGuestFlow', 'guest_flow'),
+}
+REPORTS_DIR = Path.home() / "Documents" / "Отчёты iiko"
+REPORT_INFO_PROPERTY = "iiko_report"
+STYLES_PART = "xl/styles.xml"
+CUSTOM_PROPS_PART = "docProps/custom.xml"
+CUSTOM_PROPS_NS = {'p': "http://schemas.openxmlformats.org/officeDocument/2006/custom-properties",
+                   'vt': "http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes"}
+SHEET_PART = re.compile(r"xl/worksheets/sheet(\d+)\.xml")
+READ_BLOCK_SIZE = 1024 * 1024
+STREAMING_MIN_CELLS = 20000  # пар (дата, касса), начиная с которых книга пишется потоково
+PROCESS_MIN_CELLS = 50000    # пар (дата, касса), начиная с которых листы пишутся в отдельных процессах
+# % выполнения и ИТОГО: формулами, готовыми значениями или формулами с сохраненными значениями
+FORMULA_MODES = ('formulas', 'values', 'cached')
+DATA_FORMATS = ('csv', 'parquet', 'feather')  # выгрузка данных отчета без оформления (parquet/feather — с pyarrow)
+# ячейка с формулой без сохраненного значения в XML листа: <c r="E4" ...><f>...</f><v/></c>
+EMPTY_FORMULA_VALUE = re.compile(rb'(<c r="([A-Z]+)(\d+)"[^>]*><f>[^<]*</f>)<v(?:\s*/>|></v>)')
+
 
 class ReportGenerator:
-    def __init__(self, log_callback=None):
+    def __init__(self, log_callback=None, streaming=None, job=None, processes=None, formulas='formulas'):
         self.log = log_callback or (lambda msg: print(msg))
-
-    def calculate_revenue_fact(self, cash_data, avg_data_dict, date_str, base_name):
-        if not cash_data.empty:
-            return cash_data.iloc[0].get('DishDiscountSumInt', 0)
-        return 0
-
-    def calculate_occupancy_fact(self, cash_data, avg_data_dict, date_str, base_name):
-        fact_occupancy = 0
-        if base_name and base_name in avg_data_dict:
-            avg_data = avg_data_dict[base_name]
-            for item in avg_data:
-                if ('OpenDate.Typed' in item and 
-                    item.get('OpenDate.Typed', '').startswith(date_str) and
-                    item.get('Store.Name') == cash_data.iloc[0]['Store.Name'] if not cash_data.empty else None):
-                    dish_amount = item.get('DishAmountInt', 0)
-                    guest_num = item.get('GuestNum', 0)
-                    if guest_num > 0:
-                        fact_occupancy = round(dish_amount / guest_num, 2)
-                    break
-        return fact_occupancy
-
-    def calculate_dish_price_fact(self, cash_data, avg_data_dict, date_str, base_name):
-        fact_dish_price = 0
-        if base_name and base_name in avg_data_dict:
-            avg_data = avg_data_dict[base_name]
-            for item in avg_data:
-                if ('OpenDate.Typed' in item and 
-                    item.get('OpenDate.Typed', '').startswith(date_str) and
-                    item.get('Store.Name') == cash_data.iloc[0]['Store.Name'] if not cash_data.empty else None):
-                    dish_discount_sum = item.get('DishDiscountSumInt', 0)
-                    dish_amount = item.get('DishAmountInt', 0)
-                    if dish_amount > 0:
-                        fact_dish_price = round(dish_discount_sum / dish_amount, 2)
-                    break
-        return fact_dish_price
-
-    def calculate_guest_flow_fact(self, cash_data, avg_data_dict, date_str, base_name):
-        fact_guest_flow = 0
-        if base_name and base_name in avg_data_dict:
-            avg_data = avg_data_dict[base_name]
-            for item in avg_data:
-                if ('OpenDate.Typed' in item and 
-                    item.get('OpenDate.Typed', '').startswith(date_str) and
-                    item.get('Store.Name') == cash_data.iloc[0]['Store.Name'] if not cash_data.empty else None):
-                    fact_guest_flow = item.get('GuestNum', 0)
-                    break
-        return fact_guest_flow
-
-    def create_generic_report_sheet(self, wb, df, cash_registers, average_data_dict, sheet_title, fact_calculator, plan_field_name):
-        ws = wb.create_sheet(title=sheet_title)
-        ws['A1'] = sheet_title.upper()
-        ws['A1'].font = Font(bold=True, size=16)
-        ws.merge_cells('A1:E1')
-
-        base_colors = {
-            0: "E2EFDA", 1: "FFEB9C", 2: "C6E0B4", 3: "FFE699",
-            4: "A9D08E", 5: "F8CBAD", 6: "9CC2E5", 7: "D9E1F2",
+        # True — потоковая запись (write-only), False — обычная книга,
+        # None — потоковая запись для больших отчетов
+        self.streaming = streaming
+        # ReportJob: прогресс по листам и отмена между листами
+        self.job = job
+        # процессов для записи листов: None — по числу ядер для больших отчетов, 1 — без процессов
+        self.processes = processes
+        # % выполнения и ИТОГО: 'formulas' — формулы, которые Excel считает при открытии,
+        # 'values' — готовые значения, 'cached' — формулы с сохраненными значениями
+        if formulas not in FORMULA_MODES:
+            raise ValueError(f"неизвестный режим формул: {formulas}")
+        self.formulas = formulas
+
+    def calculate_revenue_fact(self, cells):
+        # для баз с фактом из OLAP-запроса выручка — из его суммы, а не из строки пресета
+        revenue = _numeric(cells, 'DishDiscountSumInt')
+        return revenue.where(~cells['OlapFacts'], cells['Fact.DishDiscountSumInt'])
+
+    def build_fact_index(self, average):
+        """Индекс фактических показателей: (база, касса, дата) -> метрики.
+
+        Строится один раз на отчет по строкам средних OlapFrame; факт для всех
+        ячеек листа затем берется из индекса одним выравниванием по ключу.
+        Как и план, факт берется из первой строки на (база, касса, дата).
+        """
+        keys = ['BaseName', 'Store.Name', 'OpenDate.Typed']
+        facts = average[keys].astype({'BaseName': object, 'Store.Name': object})
+        for field in FACT_FIELDS:
+            facts[field] = _numeric(average, field)
+        return facts.groupby(keys).first()
+
+    def build_cell_frame(self, df, fact_index, fact_bases=()):
+        """Данные ячеек отчета: первая строка на пару (дата, касса) и факт из индекса.
+
+        fact_bases — базы с фактом из OLAP-запроса (колонка OlapFacts).
+        """
+        cells = df.groupby(['OpenDate.Typed', 'Store.Name'], sort=False, observed=True).first().reset_index()
+        keys = pd.MultiIndex.from_arrays([
+            cells['BaseName'].astype(object), cells['Store.Name'].astype(object), cells['OpenDate.Typed']
+        ])
+        facts = fact_index.reindex(keys)
+        for field in FACT_FIELDS:
+            cells[f'Fact.{field}'] = pd.to_numeric(facts[field]).fillna(0).to_numpy()
+        cells['OlapFacts'] = cells['BaseName'].astype(object).isin(fact_bases).to_numpy()
+        return cells
+
+    def calculate_occupancy_fact(self, cells):
+        dish_amount = cells['Fact.DishAmountInt']
+        guest_num = cells['Fact.GuestNum']
+        return _round2(dish_amount / guest_num.where(guest_num > 0))
+
+    def calculate_dish_price_fact(self, cells):
+        dish_discount_sum = cells['Fact.DishDiscountSumInt']
+        dish_amount = cells['Fact.DishAmountInt']
+        return _round2(dish_discount_sum / dish_amount.where(dish_amount > 0))
+
+    def calculate_guest_flow_fact(self, cells):
+        return cells['Fact.GuestNum']
+
+    def build_metrics_table(self, df, cash_registers, fact_index, fact_bases=()):
+        """Таблица всех метрик отчета за один проход по данным.
+
+        Строка на каждую пару (дата, касса) в порядке дат и касс, колонки
+        Plan.<метрика> и Fact.<метрика> для всех листов REPORT_SHEETS.
+        Листы только вырезают из нее свои колонки.
+        """
+        cells = self.build_cell_frame(df, fact_index, fact_bases)
+        calculators = {
+            'revenue': self.calculate_revenue_fact,
+            'occupancy': self.calculate_occupancy_fact,
+            'dish_price': self.calculate_dish_price_fact,
+            'guest_flow': self.calculate_guest_flow_fact,
         }
-
-        headers = ["День недели", "Дата", "План", "Факт", "% выполнения"]
-        col_offset = 0
-        base_index = 0
-
-        for cash_register in cash_registers:
-            start_col = col_offset + 1
-            end_col = col_offset + len(headers)
-            ws.merge_cells(start_row=2, start_column=start_col, end_row=2, end_column=end_col)
-            ws.cell(row=2, column=start_col, value=cash_register).font = Font(bold=True)
-            ws.cell(row=2, column=start_col).alignment = Alignment(horizontal='center')
-            color = base_colors[base_index % len(base_colors)]
-            ws.cell(row=2, column=start_col).fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-
-            for i, header in enumerate(headers):
-                cell = ws.cell(row=3, column=col_offset + i + 1, value=header)
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-
-            col_offset += len(headers)
-            base_index += 1
+        metrics = cells[['OpenDate.Typed', 'Store.Name', 'BaseName']].copy()
+        value_columns = []
+        for _, plan_field, metric in REPORT_SHEETS.values():
+            metrics[f'Plan.{metric}'] = _numeric(cells, plan_field)
+            metrics[f'Fact.{metric}'] = calculators[metric](cells)
+            value_columns += [f'Plan.{metric}', f'Fact.{metric}']
 
         dates = sorted(df['OpenDate.Typed'].unique())
-        current_row = 4
-
-        for date in dates:
-            day_of_week = df[df['OpenDate.Typed'] == date]['DayOfWeekOpen'].iloc[0] if not df[df['OpenDate.Typed'] == date].empty else ""
-            formatted_date = df[df['OpenDate.Typed'] == date]['Date'].iloc[0] if not df[df['OpenDate.Typed'] == date].empty else ""
-            col_offset = 0
-
-            for cash_register in cash_registers:
-                ws.cell(row=current_row, column=col_offset + 1, value=day_of_week)
-                ws.cell(row=current_row, column=col_offset + 2, value=formatted_date)
-
-                cash_data = df[(df['OpenDate.Typed'] == date) & (df['Store.Name'] == cash_register)]
-                base_name = cash_data.iloc[0]['BaseName'] if not cash_data.empty and 'BaseName' in cash_data.iloc[0] else None
-
-                plan_value = cash_data.iloc[0].get(plan_field_name, 0) if not cash_data.empty else 0
-                ws.cell(row=current_row, column=col_offset + 3, value=plan_value)
-
-                date_str = date.strftime('%Y-%m-%d')
-                fact_value = fact_calculator(cash_data, average_data_dict, date_str, base_name)
-                ws.cell(row=current_row, column=col_offset + 4, value=fact_value)
-
-                plan_col_letter = get_column_letter(col_offset + 3)
-                fact_col_letter = get_column_letter(col_offset + 4)
-                formula = f"=IF({plan_col_letter}{current_row}=0, 0, {fact_col_letter}{current_row}/{plan_col_letter}{current_row})"
-                ws.cell(row=current_row, column=col_offset + 5, value=formula).number_format = '0.00%'
-
-                col_offset += len(headers)
+        grid = pd.MultiIndex.from_product([dates, list(cash_registers)], names=['OpenDate.Typed', 'Store.Name'])
+        metrics = metrics.set_index(['OpenDate.Typed', 'Store.Name']).reindex(grid)
+        metrics[value_columns] = metrics[value_columns].fillna(0)
+
+        day_columns = [column for column in ('DayOfWeekOpen', 'Date') if column in df.columns]
+        days = df.groupby('OpenDate.Typed')[day_columns].first()
+        metrics = metrics.reset_index().join(days, on='OpenDate.Typed')
+        if 'DayOfWeekOpen' not in metrics.columns:
+            metrics['DayOfWeekOpen'] = ""
+        return metrics
+
+    def sheet_matrix(self, metrics, cash_registers, metric):
+        """Срез таблицы метрик для листа: даты и матрицы план/факт (даты × кассы)"""
+        register_count = len(cash_registers)
+        day_of_week = metrics['DayOfWeekOpen'].iloc[::register_count].tolist()
+        formatted_dates = metrics['Date'].iloc[::register_count].tolist()
+        plan_rows = metrics[f'Plan.{metric}'].to_numpy().reshape(-1, register_count)
+        fact_rows = metrics[f'Fact.{metric}'].to_numpy().reshape(-1, register_count)
+        return day_of_week, formatted_dates, _to_rows(plan_rows), _to_rows(fact_rows)
+
+    def sheet_aggregates(self, metrics, cash_registers, sheet_title, metric):
+        """Процент выполнения и ИТОГО листа по таблице метрик (см. plan_fact_aggregates)"""
+        register_count = len(cash_registers)
+        plan = metrics[f'Plan.{metric}'].to_numpy(dtype=float).reshape(-1, register_count)
+        fact = metrics[f'Fact.{metric}'].to_numpy(dtype=float).reshape(-1, register_count)
+        return plan_fact_aggregates(plan, fact, total_is_sum(sheet_title))
+
+    def create_generic_report_sheet(self, wb, metrics, cash_registers, sheet_title, metric):
+        """Лист план-факт. Строки формируются по одной и сразу пишутся в лист,
+        в потоковом режиме (write-only) они не накапливаются в памяти."""
+        day_of_week, formatted_dates, plan_rows, fact_rows = self.sheet_matrix(metrics, cash_registers, metric)
+        percent_rows, totals = None, None
+        if self.formulas == 'values':
+            percent, plan_total, fact_total, percent_total = self.sheet_aggregates(
+                metrics, cash_registers, sheet_title, metric)
+            percent_rows = _to_rows(percent)
+            totals = _to_rows(np.vstack([plan_total, fact_total, percent_total]))
+        ws = wb.create_sheet(title=sheet_title)
+        col_count = len(cash_registers) * len(HEADERS)
 
+        # ширины колонок и объединения в потоковом режиме задаются до записи строк
+        for col in range(1, col_count + 1):
+            ws.column_dimensions[get_column_letter(col)].width = 15
+        merged_ranges = [CellRange('A1:E1')]
+        for register_index in range(len(cash_registers)):
+            start_col = register_index * len(HEADERS) + 1
+            merged_ranges.append(CellRange(min_col=start_col, min_row=2, max_col=start_col + len(HEADERS) - 1, max_row=2))
+
+        last_data_row = 3 + len(formatted_dates)
+        rows = itertools.chain(
+            self._header_rows(sheet_title, cash_registers),
+            self._data_rows(len(cash_registers), day_of_week, formatted_dates, plan_rows, fact_rows, 4, percent_rows),
+            [self._total_row(sheet_title, len(cash_registers), last_data_row + 1, totals)],
+        )
+        if isinstance(ws, WriteOnlyWorksheet):
+            for merged_range in merged_ranges:
+                ws.merged_cells.add(merged_range)
+            cell_cache = {}
+            for row in rows:
+                ws.append([
+                    self._write_only_cell(ws, cell_cache, col_number, value, style)
+                    for col_number, (value, style) in enumerate(row)
+                ])
+        else:
+            for merged_range in merged_ranges:
+                ws.merge_cells(merged_range.coord)
+            self._write_rows(ws, rows, 1)
+
+        self._add_percent_formatting(ws, len(cash_registers), last_data_row)
+
+    def _header_rows(self, sheet_title, cash_registers):
+        """Заголовок листа, строка касс и строка названий колонок"""
+        col_count = len(cash_registers) * len(HEADERS)
+
+        yield [(sheet_title.upper(), 'pf_title')] + [(None, None)] * (col_count - 1)
+
+        store_row = []
+        for register_index, cash_register in enumerate(cash_registers):
+            store_style = f"pf_store_{register_index % len(BASE_COLORS)}"
+            store_row.append((cash_register, store_style))
+            store_row.extend([(None, 'pf_cell')] * (len(HEADERS) - 1))
+        yield store_row
+
+        yield [(header, 'pf_header') for _ in cash_registers for header in HEADERS]
+
+    def _data_rows(self, register_count, day_of_week, formatted_dates, plan_rows, fact_rows, first_row,
+                   percent_rows=None):
+        """Строки дат начиная с листовой строки first_row: пары (значение, имя стиля).
+
+        % выполнения — формула или, если переданы percent_rows, готовое значение.
+        """
+        current_row = first_row
+        for row_index in range(len(formatted_dates)):
+            row = []
+            for register_index in range(register_count):
+                if percent_rows is None:
+                    col_offset = register_index * len(HEADERS)
+                    plan_col_letter = get_column_letter(col_offset + 3)
+                    fact_col_letter = get_column_letter(col_offset + 4)
+                    percent = f"=IF({plan_col_letter}{current_row}=0, 0, {fact_col_letter}{current_row}/{plan_col_letter}{current_row})"
+                else:
+                    percent = percent_rows[row_index][register_index]
+                row.extend([
+                    (day_of_week[row_index], 'pf_cell'),
+                    (formatted_dates[row_index], 'pf_cell'),
+                    (plan_rows[row_index][register_index], 'pf_cell'),
+                    (fact_rows[row_index][register_index], 'pf_cell'),
+                    (percent, 'pf_percent'),
+                ])
+            yield row
             current_row += 1
 
-        total_row = current_row
-        ws.cell(row=total_row, column=1, value="ИТОГО").font = Font(bold=True)
-        ws.cell(row=total_row, column=2, value=datetime.now().strftime('%d.%m.%Y')).font = Font(bold=True)
+    def _total_row(self, sheet_title, register_count, total_row, totals=None):
+        """Строка ИТОГО с формулами по строкам дат 4..total_row-1.
 
-        col_offset = 0
-        for cash_register in cash_registers:
+        totals — готовые значения (строки плана, факта и процента по кассам) вместо формул.
+        """
+        sum_total = total_is_sum(sheet_title)
+        row = []
+        for register_index in range(register_count):
+            col_offset = register_index * len(HEADERS)
             plan_col = get_column_letter(col_offset + 3)
             fact_col = get_column_letter(col_offset + 4)
-
-            if "выручк" in sheet_title.lower() or "гостепоток" in sheet_title.lower():
-                ws.cell(row=total_row, column=col_offset + 3, value=f"=SUM({plan_col}4:{plan_col}{current_row-1})")
+            if totals is not None:
+                plan_total, fact_total, percent = (values[register_index] for values in totals)
             else:
-                ws.cell(row=total_row, column=col_offset + 3, value=f"=ROUND(AVERAGE({plan_col}4:{plan_col}{current_row-1}),2)")
-
-            if "выручк" in sheet_title.lower() or "гостепоток" in sheet_title.lower():
-                ws.cell(row=total_row, column=col_offset + 4, value=f"=SUM({fact_col}4:{fact_col}{current_row-1})")
+                if sum_total:
+                    plan_total = f"=SUM({plan_col}4:{plan_col}{total_row-1})"
+                    fact_total = f"=SUM({fact_col}4:{fact_col}{total_row-1})"
+                else:
+                    plan_total = f"=ROUND(AVERAGE({plan_col}4:{plan_col}{total_row-1}),2)"
+                    fact_total = f"=ROUND(AVERAGE({fact_col}4:{fact_col}{total_row-1}),2)"
+                percent = f"=IF({plan_col}{total_row}=0, 0, {fact_col}{total_row}/{plan_col}{total_row})"
+            if register_index == 0:
+                row.extend([("ИТОГО", 'pf_total'), (datetime.now().strftime('%d.%m.%Y'), 'pf_total')])
             else:
-                ws.cell(row=total_row, column=col_offset + 4, value=f"=ROUND(AVERAGE({fact_col}4:{fact_col}{current_row-1}),2)")
-
-            ws.cell(row=total_row, column=col_offset + 3).font = Font(bold=True)
-            ws.cell(row=total_row, column=col_offset + 4).font = Font(bold=True)
-
-            plan_total_col = get_column_letter(col_offset + 3)
-            fact_total_col = get_column_letter(col_offset + 4)
-            formula = f"=IF({plan_total_col}{current_row}=0, 0, {fact_total_col}{current_row}/{plan_total_col}{current_row})"
-            ws.cell(row=total_row, column=col_offset + 5, value=formula).number_format = '0.00%'.font = Font(bold=True)
-
-            col_offset += len(headers)
-
-        for col in range(1, col_offset + 1):
-            ws.column_dimensions[get_column_letter(col)].width = 15
-
+                row.extend([(None, 'pf_cell'), (None, 'pf_cell')])
+            row.extend([(plan_total, 'pf_total'), (fact_total, 'pf_total'), (percent, 'pf_total_percent')])
+        return row
+
+    def _write_rows(self, ws, rows, first_row):
+        """Запись строк (значение, стиль) в обычный лист начиная с first_row"""
+        for row_number, row in enumerate(rows, start=first_row):
+            for col_number, (value, style) in enumerate(row, start=1):
+                if style is None and value is None:
+                    continue
+                cell = ws.cell(row=row_number, column=col_number, value=value)
+                if style is not None:
+                    cell.style = style
+
+    def _add_percent_formatting(self, ws, register_count, last_data_row):
+        for register_index in range(register_count):
+            percent_letter = get_column_letter(register_index * len(HEADERS) + 5)
+            percent_range = f"{percent_letter}4:{percent_letter}{last_data_row}"
+            ws.conditional_formatting.add(percent_range, CellIsRule(operator='greaterThanOrEqual', formula=['1'], fill=GREEN_FILL))
+            ws.conditional_formatting.add(percent_range, CellIsRule(operator='lessThan', formula=['1'], fill=RED_FILL))
+
+    def _write_only_cell(self, ws, cell_cache, col_number, value, style):
+        # строка сериализуется сразу в append, поэтому ячейку колонки с тем же
+        # стилем можно переиспользовать и не назначать стиль заново
+        if style is None:
+            return value
+        cell = cell_cache.get((col_number, style))
+        if cell is None:
+            cell = WriteOnlyCell(ws)
+            cell.style = style
+            cell_cache[(col_number, style)] = cell
+        cell.value = value
+        return cell
+
+    def _register_styles(self, wb):
+        """Именованные стили отчета: один объект стиля на книгу вместо объекта на ячейку"""
         thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        for row in range(2, total_row + 1):
-            for col in range(1, col_offset + 1):
-                ws.cell(row=row, column=col).border = thin_border
-
-        col_offset = 0
-        for cash_register in cash_registers:
-            percent_col = col_offset + 5
-            percent_letter = get_column_letter(percent_col)
-            percent_range = f"{percent_letter}4:{percent_letter}{current_row-1}"
-
-            rule_green = CellIsRule(operator='greaterThanOrEqual', formula=['1'], fill=PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"))
-            ws.conditional_formatting.add(percent_range, rule_green)
-
-            rule_red = CellIsRule(operator='lessThan', formula=['1'], fill=PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"))
-            ws.conditional_formatting.add(percent_range, rule_red)
-
-            col_offset += len(headers)
-
-    def create_excel_report(self, all_data, bases_config, output_filename, start_date, end_date, average_data_dict, selected_sheets):
+        styles = [
+            NamedStyle(name='pf_title', font=Font(bold=True, size=16)),
+            NamedStyle(name='pf_header', font=Font(bold=True), border=thin_border,
+                       fill=PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")),
+            NamedStyle(name='pf_cell', border=thin_border),
+            NamedStyle(name='pf_percent', border=thin_border, number_format='0.00%'),
+            NamedStyle(name='pf_total', font=Font(bold=True), border=thin_border),
+            NamedStyle(name='pf_total_percent', font=Font(bold=True), border=thin_border, number_format='0.00%'),
+        ]
+        for index, color in BASE_COLORS.items():
+            styles.append(NamedStyle(
+                name=f"pf_store_{index}", font=Font(bold=True), border=thin_border,
+                alignment=Alignment(horizontal='center'),
+                fill=PatternFill(start_color=color, end_color=color, fill_type="solid")
+            ))
+        for style in styles:
+            if style.name not in wb.named_styles:
+                wb.add_named_style(style)
+
+    def prepare_report_data(self, all_data, average_data_dict=None, cash_registers=None):
+        """Таблица метрик и список касс из собранных данных (None, если касс нет).
+
+        all_data — OlapFrame или, как раньше, список строк со словарем строк
+        средних average_data_dict. cash_registers задает порядок колонок касс,
+        например, как в уже существующем отчете.
+        """
+        with span('report.metrics'):
+            return self._prepare_report_data(as_olap_frame(all_data, average_data_dict), cash_registers)
+
+    def _prepare_report_data(self, frame, cash_registers):
+        if frame.empty:
+            return None, []
+        df = frame.rows.copy()
+        df['Date'] = df['OpenDate.Typed'].dt.strftime('%d.%m.%Y')
+
+        if df['DayOfWeekOpen'].notna().any():
+            df['DayOfWeek'] = df['DayOfWeekOpen'].astype(object).str.extract(r'(\d+)\.')[0].astype(int)
+        else:
+            df = df.drop(columns='DayOfWeekOpen')
+            df['DayOfWeek'] = df['OpenDate.Typed'].dt.dayofweek + 1
+
+        df = df.sort_values(['OpenDate.Typed', 'DayOfWeek'])
+        if cash_registers is None:
+            cash_registers = frame.stores()
+
+        if len(cash_registers) == 0:
+            return None, cash_registers
+
+        fact_index = self.build_fact_index(frame.average)
+        return self.build_metrics_table(df, cash_registers, fact_index, frame.fact_bases), cash_registers
+
+    def create_excel_report(self, all_data, bases_config, output_filename, start_date, end_date, average_data_dict, selected_sheets,
+                            bases=None, failed_bases=()):
         if not all_data:
             self.log("❌ Нет данных для создания отчета")
             return False
 
         try:
-            df = pd.DataFrame(all_data)
-            df['OpenDate.Typed'] = pd.to_datetime(df['OpenDate.Typed'])
-            df['Date'] = df['OpenDate.Typed'].dt.strftime('%d.%m.%Y')
-
-            if 'DayOfWeekOpen' in df.columns:
-                df['DayOfWeek'] = df['DayOfWeekOpen'].str.extract(r'(\d+)\.')[0].astype(int)
-            else:
-                df['DayOfWeek'] = df['OpenDate.Typed'].dt.dayofweek + 1
-
-            df = df.sort_values(['OpenDate.Typed', 'DayOfWeek'])
-            cash_registers = df['Store.Name'].unique() if 'Store.Name' in df.columns else []
-
-            if len(cash_registers) == 0:
+            frame = as_olap_frame(all_data, average_data_dict)
+            metrics, cash_registers = self.prepare_report_data(frame)
+            if metrics is None:
                 self.log("❌ Нет данных о кассах")
                 return False
+            report_info = build_report_info(bases if bases is not None else frame.base_names(),
+                                            start_date, end_date, selected_sheets, cash_registers, failed_bases)
+            return self.write_excel_report(metrics, cash_registers, output_filename, selected_sheets, report_info)
 
-            wb = Workbook()
-            while len(wb.sheetnames) > 0:
-                del wb[wb.sheetnames[0]]
-
-            if 1 in selected_sheets:
-                self.create_generic_report_sheet(
-                    wb, df, cash_registers, average_data_dict,
-                    "Свод План-Факт", self.calculate_revenue_fact, 'PlanValue'
-                )
-            if 2 in selected_sheets:
-                self.create_generic_report_sheet(
-                    wb, df, cash_registers, average_data_dict,
-                    "План_факт наполняемость", self.calculate_occupancy_fact, 'PlanOccupancy'
-                )
-            if 3 in selected_sheets:
-                self.create_generic_report_sheet(
-                    wb, df, cash_registers, average_data_dict,
-                    "План_факт стоимость блюд", self.calculate_dish_price_fact, 'PlanDishPrice'
-                )
-            if 4 in selected_sheets:
-                self.create_generic_report_sheet(
-                    wb, df, cash_registers, average_data_dict,
-                    "План_факт гостепоток", self.calculate_guest_flow_fact, 'PlanGuestFlow'
-                )
+        except JobCancelled:
+            raise
+        except Exception as e:
+            self.log(f"❌ Ошибка при создании отчета: {str(e)}")
+            return False
 
+    def write_excel_report(self, metrics, cash_registers, output_filename, selected_sheets, report_info=None):
+        """Запись книги Excel по готовой таблице метрик.
+
+        report_info (базы, период, листы, кассы, дата формирования) сохраняется
+        в свойствах книги и нужен для последующего дополнения отчета.
+        Большие отчеты с несколькими листами пишутся в пуле процессов.
+        В режиме formulas='cached' после записи в формулы добавляются их значения.
+        """
+        if report_info is not None:
+            report_info = dict(report_info, formulas=self.formulas)
+        streaming = self.streaming
+        if streaming is None:
+            streaming = len(metrics) >= STREAMING_MIN_CELLS
+        sheets = [(title, metric) for key, (title, _, metric) in REPORT_SHEETS.items() if key in selected_sheets]
+        if self.job is not None:
+            self.job.add_units(len(sheets))
+
+        processes = self._sheet_processes(metrics, sheets)
+        if processes > 1:
+            try:
+                with span('report.sheets_parallel'):
+                    self._write_sheets_parallel(metrics, cash_registers, output_filename, sheets,
+                                                report_info, streaming, processes)
+                self._store_formula_values(output_filename, metrics, cash_registers, sheets)
+                self.log(f"✅ Отчет сохранен: {output_filename}")
+                return True
+            except JobCancelled:
+                raise
+            except Exception as e:
+                self.log(f"⚠️ Листы не удалось записать параллельно ({str(e)}), записываем по очереди")
+
+        wb = Workbook(write_only=streaming)
+        while len(wb.sheetnames) > 0:
+            del wb[wb.sheetnames[0]]
+        self._register_styles(wb)
+
+        for sheet_title, metric in sheets:
+            if self.job is not None:
+                self.job.check()
+                self.job.set_stage(sheet_title)
+            with span(f'report.sheet.{metric}'):
+                self.create_generic_report_sheet(wb, metrics, cash_registers, sheet_title, metric)
+            count('report.cells', len(metrics) * len(HEADERS))
+            if self.job is not None:
+                self.job.complete_unit()
+
+        if report_info is not None:
+            _set_report_info(wb, report_info)
+        _set_calculation(wb, self.formulas)
+        with span('report.save'):
             wb.save(output_filename)
-            self.log(f"✅ Отчет сохранен: {output_filename}")
+        self._store_formula_values(output_filename, metrics, cash_registers, sheets)
+        self.log(f"✅ Отчет сохранен: {output_filename}")
+        return True
+
+    def long_table(self, metrics, cash_registers, selected_sheets):
+        """Данные листов в длинном формате: строка на (база, касса, дата, метрика).
+
+        Колонки BaseName, Store.Name, Date, DayOfWeekOpen, Metric, Plan, Fact
+        и Percent (0 при нулевом плане, как в листе). Сетка та же, что в
+        листах: дни без данных кассы идут с нулями.
+        """
+        metric_names = [metric for key, (_, _, metric) in REPORT_SHEETS.items() if key in selected_sheets]
+        stores = metrics['Store.Name'].astype(object)
+        # у пар (дата, касса) без строк база не заполнена — берем её по кассе
+        known = metrics['BaseName'].notna()
+        store_bases = dict(zip(stores[known], metrics['BaseName'][known].astype(object)))
+        keys = pd.DataFrame({
+            'BaseName': pd.Categorical(stores.map(store_bases)),
+            'Store.Name': pd.Categorical(stores, categories=list(cash_registers)),
+            'Date': metrics['OpenDate.Typed'].to_numpy(),
+            'DayOfWeekOpen': pd.Categorical(metrics['DayOfWeekOpen'].astype(object)),
+        })
+        parts = []
+        for metric in metric_names:
+            plan = metrics[f'Plan.{metric}'].to_numpy(dtype=float)
+            fact = metrics[f'Fact.{metric}'].to_numpy(dtype=float)
+            parts.append(keys.assign(Metric=metric, Plan=plan, Fact=fact, Percent=_percent(fact, plan)))
+        table = pd.concat(parts, ignore_index=True)
+        table['Metric'] = pd.Categorical(table['Metric'], categories=metric_names)
+        return table
+
+    def write_data_export(self, metrics, cash_registers, output_filename, selected_sheets):
+        """Данные отчета без оформления в .csv, .parquet или .feather (по расширению файла).
+
+        Пишется long_table по той же таблице метрик, что и книга Excel, — для
+        загрузки в BI без разбора листов по ячейкам.
+        """
+        path = Path(output_filename)
+        suffix = path.suffix.lower()
+        if suffix.lstrip('.') not in DATA_FORMATS:
+            raise ValueError(f"неизвестный формат выгрузки: {path.name}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with span('report.data_export'):
+            table = self.long_table(metrics, cash_registers, selected_sheets)
+            if suffix == '.csv':
+                table.to_csv(path, index=False, encoding='utf-8', date_format='%Y-%m-%d')
+            elif suffix == '.parquet':
+                table.to_parquet(path, index=False)
+            else:
+                table.to_feather(path)
+        count('report.export_rows', len(table))
+        self.log(f"✅ Данные отчета сохранены: {path}")
+        return path
+
+    def _store_formula_values(self, output_filename, metrics, cash_registers, sheets):
+        """Сохраненные значения формул % и ИТОГО (режим 'cached').
+
+        openpyxl пишет формулы без значений, поэтому Excel пересчитывает книгу
+        при открытии, а чтение с data_only дает None. Значения считаются по
+        таблице метрик и вписываются в XML уже записанных листов.
+        """
+        if self.formulas != 'cached':
+            return
+        with span('report.formula_values'):
+            lookups = [
+                _formula_values(self.sheet_aggregates(metrics, cash_registers, sheet_title, metric), 4)
+                for sheet_title, metric in sheets
+            ]
+            _fill_formula_values(output_filename, lookups)
+
+    def write_excel_reports(self, reports):
+        """Запись нескольких независимых отчетов (по периодам или базам).
+
+        reports — список (metrics, cash_registers, output_filename,
+        selected_sheets, report_info). При нескольких отчетах и доступных ядрах
+        каждый отчет пишется в своем процессе; небольшие отчеты (всего меньше
+        PROCESS_MIN_CELLS строк) без явного processes пишутся в текущем
+        процессе, где запуск пула дороже самой записи. Возвращает число неудачных.
+        """
+        processes = self.processes
+        if processes is None:
+            small = sum(len(report[0]) for report in reports) < PROCESS_MIN_CELLS
+            processes = 1 if small else (os.cpu_count() or 1)
+        processes = max(1, min(processes, len(reports)))
+        failed = 0
+        if processes == 1:
+            for metrics, cash_registers, output_filename, selected_sheets, report_info in reports:
+                try:
+                    self.write_excel_report(metrics, cash_registers, output_filename, selected_sheets, report_info)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    self.log(f"❌ Ошибка при создании отчета {output_filename}: {str(e)}")
+                    failed += 1
+            return failed
+
+        if self.job is not None:
+            self.job.add_units(len(reports))
+        executor = ProcessPoolExecutor(max_workers=processes)
+        try:
+            futures = [executor.submit(_render_report, *report, self.streaming, self.formulas) for report in reports]
+            for future, report in zip(futures, reports):
+                output_filename = report[2]
+                try:
+                    with span('report.batch_wait'):
+                        self._wait_part(future)
+                    self.log(f"✅ Отчет сохранен: {output_filename}")
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    self.log(f"❌ Ошибка при создании отчета {output_filename}: {str(e)}")
+                    failed += 1
+                if self.job is not None:
+                    self.job.complete_unit()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return failed
+
+    def _sheet_processes(self, metrics, sheets):
+        """Сколько процессов использовать для листов (1 — писать в текущем процессе)"""
+        processes = self.processes
+        if processes is None:
+            if len(metrics) < PROCESS_MIN_CELLS:
+                return 1
+            processes = os.cpu_count() or 1
+        return max(1, min(processes, len(sheets)))
+
+    def _write_sheets_parallel(self, metrics, cash_registers, output_filename, sheets, report_info, streaming, processes):
+        """Листы в отдельных процессах, каждый в свою книгу из одного листа.
+
+        Части собираются в итоговый файл заменой XML листов в книге-каркасе
+        с теми же листами, стилями и свойствами. Стили во всех частях
+        регистрируются в одном порядке, поэтому индексы стилей ячеек совпадают;
+        это проверяется, и при расхождении выбрасывается ValueError.
+        """
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_dir = Path(work_dir)
+            executor = ProcessPoolExecutor(max_workers=processes)
+            try:
+                # в процесс передаются только колонки его листа
+                futures = [
+                    executor.submit(_render_sheet_part, _sheet_columns(metrics, metric), list(cash_registers),
+                                    sheet_title, metric, streaming, self.formulas, str(work_dir / f"part{index}.xlsx"))
+                    for index, (sheet_title, metric) in enumerate(sheets)
+                ]
+                parts = []
+                for future, (sheet_title, _) in zip(futures, sheets):
+                    if self.job is not None:
+                        self.job.set_stage(sheet_title)
+                    parts.append(self._wait_part(future))
+                    count('report.cells', len(metrics) * len(HEADERS))
+                    if self.job is not None:
+                        self.job.complete_unit()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+            wb = Workbook(write_only=True)
+            self._register_styles(wb)
+            for sheet_title, _ in sheets:
+                wb.create_sheet(title=sheet_title)
+            if report_info is not None:
+                _set_report_info(wb, report_info)
+            _set_calculation(wb, self.formulas)
+            skeleton = work_dir / "skeleton.xlsx"
+            wb.save(skeleton)
+            with span('report.save'):
+                _assemble_workbook(skeleton, parts, output_filename)
+
+    def _wait_part(self, future):
+        """Результат процесса листа; при отмене выгрузки ожидание прерывается"""
+        while True:
+            if self.job is not None:
+                self.job.check()
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeoutError:
+                continue
+
+    def update_excel_report(self, output_filename, all_data, average_data_dict, refresh_from, report_info):
+        """Дополнение существующего отчета.
+
+        В каждом листе строки с даты refresh_from и строка ИТОГО удаляются и
+        пишутся заново по новым данным; более ранние (закрытые) дни не трогаются.
+        % и ИТОГО пишутся в том же режиме formulas, в котором отчет был создан;
+        для готовых и сохраненных значений ИТОГО считается с учетом прежних дней.
+        """
+        try:
+            cash_registers = report_info['stores']
+            formulas = report_info.get('formulas', 'formulas')
+            metrics = None
+            if all_data:
+                metrics, _ = self.prepare_report_data(all_data, average_data_dict, cash_registers)
+
+            with span('report.load'):
+                wb = load_workbook(output_filename)
+            self._register_styles(wb)
+            lookups = [None] * len(wb.worksheets)
+            for sheet_key, (sheet_title, _, metric) in REPORT_SHEETS.items():
+                if sheet_key not in report_info['sheets'] or sheet_title not in wb.sheetnames:
+                    continue
+                if self.job is not None:
+                    self.job.check()
+                ws = wb[sheet_title]
+                first_row = self._refresh_row(ws, refresh_from)
+                if formulas != 'formulas':
+                    kept_plan, kept_fact = _sheet_plan_fact(ws, len(cash_registers), first_row)
+                ws.delete_rows(first_row, ws.max_row - first_row + 1)
+
+                if metrics is not None:
+                    day_of_week, formatted_dates, plan_rows, fact_rows = self.sheet_matrix(metrics, cash_registers, metric)
+                else:
+                    day_of_week, formatted_dates, plan_rows, fact_rows = [], [], [], []
+                percent_rows, totals = None, None
+                if formulas != 'formulas':
+                    shape = (-1, len(cash_registers))
+                    aggregates = plan_fact_aggregates(
+                        np.vstack([kept_plan, np.array(plan_rows, dtype=float).reshape(shape)]),
+                        np.vstack([kept_fact, np.array(fact_rows, dtype=float).reshape(shape)]),
+                        total_is_sum(sheet_title),
+                    )
+                    if formulas == 'values':
+                        percent_rows = _to_rows(aggregates[0][first_row - 4:])
+                        totals = _to_rows(np.vstack(aggregates[1:]))
+                    else:
+                        lookups[wb.worksheets.index(ws)] = _formula_values(aggregates, 4)
+                last_data_row = first_row - 1 + len(formatted_dates)
+                rows = itertools.chain(
+                    self._data_rows(len(cash_registers), day_of_week, formatted_dates, plan_rows, fact_rows, first_row,
+                                    percent_rows),
+                    [self._total_row(sheet_title, len(cash_registers), last_data_row + 1, totals)],
+                )
+                self._write_rows(ws, rows, first_row)
+                ws.conditional_formatting = ConditionalFormattingList()
+                self._add_percent_formatting(ws, len(cash_registers), last_data_row)
+
+            report_info = dict(report_info, generated=datetime.now().isoformat(timespec='seconds'))
+            _set_report_info(wb, report_info)
+            _set_calculation(wb, formulas)
+            with span('report.save'):
+                wb.save(output_filename)
+            if formulas == 'cached':
+                with span('report.formula_values'):
+                    _fill_formula_values(output_filename, lookups)
+            self.log(f"✅ Отчет дополнен: {output_filename}")
             return True
 
+        except JobCancelled:
+            raise
         except Exception as e:
-            self.log(f"❌ Ошибка при создании отчета: {str(e)}")
-            return False
\ No newline at end of file
+            self.log(f"❌ Ошибка при дополнении отчета: {str(e)}")
+            return False
+
+    def _refresh_row(self, ws, refresh_from):
+        """Первая строка листа, начиная с которой данные переписываются"""
+        refresh_from = as_date(refresh_from)
+        for row_number in range(4, ws.max_row + 1):
+            if ws.cell(row=row_number, column=1).value == "ИТОГО":
+                return row_number
+            value = ws.cell(row=row_number, column=2).value
+            try:
+                row_date = datetime.strptime(str(value), '%d.%m.%Y').date()
+            except ValueError:
+                continue
+            if row_date >= refresh_from:
+                return row_number
+        return ws.max_row + 1
+
+
+def default_report_path(suffix="", reports_path=REPORTS_DIR):
+    """Путь нового отчета (по умолчанию в папке Documents/Отчёты iiko)"""
+    report_date_str = datetime.now().strftime("%d_%m_%Y")
+    timestamp = int(time.time())
+    reports_path = Path(reports_path)
+    reports_path.mkdir(parents=True, exist_ok=True)
+    return reports_path / f"Свод_План_Факт_{report_date_str}_{timestamp}{suffix}.xlsx"
+
+
+def _render_sheet_part(metrics, cash_registers, sheet_title, metric, streaming, formulas, path):
+    """Книга из одного листа отчета (выполняется в процессе пула)"""
+    generator = ReportGenerator(log_callback=lambda message: None, streaming=streaming, processes=1,
+                                formulas=formulas)
+    wb = Workbook(write_only=streaming)
+    while len(wb.sheetnames) > 0:
+        del wb[wb.sheetnames[0]]
+    generator._register_styles(wb)
+    generator.create_generic_report_sheet(wb, metrics, cash_registers, sheet_title, metric)
+    wb.save(path)
+    return path
+
+
+def _render_report(metrics, cash_registers, output_filename, selected_sheets, report_info, streaming, formulas):
+    """Отдельный отчет целиком (выполняется в процессе пула)"""
+    generator = ReportGenerator(log_callback=lambda message: None, streaming=streaming, processes=1,
+                                formulas=formulas)
+    generator.write_excel_report(metrics, cash_registers, output_filename, selected_sheets, report_info)
+    return output_filename
+
+
+def _sheet_columns(metrics, metric):
+    return metrics[['DayOfWeekOpen', 'Date', f'Plan.{metric}', f'Fact.{metric}']]
+
+
+def _assemble_workbook(skeleton_path, part_paths, output_filename):
+    """Итоговая книга: каркас, в котором XML листов и стили взяты из частей"""
+    with zipfile.ZipFile(part_paths[0]) as part:
+        styles = part.read(STYLES_PART)
+    for part_path in part_paths[1:]:
+        with zipfile.ZipFile(part_path) as part:
+            if part.read(STYLES_PART) != styles:
+                raise ValueError("стили частей отчета не совпадают")
+
+    with zipfile.ZipFile(skeleton_path) as skeleton, \
+            zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as output:
+        for item in skeleton.infolist():
+            match = SHEET_PART.fullmatch(item.filename)
+            if match:
+                with zipfile.ZipFile(part_paths[int(match.group(1)) - 1]) as part, \
+                        part.open("xl/worksheets/sheet1.xml") as source, \
+                        output.open(item.filename, 'w', force_zip64=True) as target:
+                    shutil.copyfileobj(source, target, READ_BLOCK_SIZE)
+            elif item.filename == STYLES_PART:
+                output.writestr(item, styles)
+            else:
+                output.writestr(item, skeleton.read(item))
+
+
+def total_is_sum(sheet_title):
+    """ИТОГО листа — сумма по дням (True) или среднее (False)"""
+    return "выручк" in sheet_title.lower() or "гостепоток" in sheet_title.lower()
+
+
+def plan_fact_aggregates(plan, fact, sum_total):
+    """% выполнения и ИТОГО так же, как их считают формулы листа.
+
+    plan и fact — матрицы numpy (даты × кассы). Возвращает матрицу
+    процентов (0 при нулевом плане) и строки ИТОГО плана, факта и процента
+    по кассам; ИТОГО — сумма или среднее, округленное до 2 знаков.
+    """
+    percent = _percent(fact, plan)
+    if sum_total:
+        plan_total, fact_total = plan.sum(axis=0), fact.sum(axis=0)
+    elif len(plan):
+        plan_total, fact_total = _excel_round2(plan.mean(axis=0)), _excel_round2(fact.mean(axis=0))
+    else:
+        plan_total, fact_total = np.zeros(plan.shape[1]), np.zeros(fact.shape[1])
+    return percent, plan_total, fact_total, _percent(fact_total, plan_total)
+
+
+def _excel_round2(values):
+    """ROUND(x, 2) как в Excel: половина — от нуля, погрешность двоичной записи не учитывается"""
+    return np.sign(values) * np.floor(np.round(np.abs(values) * 100, 6) + 0.5) / 100
+
+
+def _percent(fact, plan):
+    return np.divide(fact, plan, out=np.zeros(np.shape(fact)), where=plan != 0)
+
+
+def _formula_values(aggregates, first_row):
+    """Значения формул листа по номеру колонки и строки (для _fill_formula_values)"""
+    percent, plan_total, fact_total, percent_total = aggregates
+    total_row = first_row + len(percent)
+
+    def lookup(column, row):
+        register_index, position = divmod(column - 1, len(HEADERS))
+        if row == total_row:
+            values = {2: plan_total, 3: fact_total, 4: percent_total}.get(position)
+            return None if values is None else values[register_index]
+        if first_row <= row < total_row and position == 4:
+            return percent[row - first_row][register_index]
+        return None
+
+    return lookup
+
+
+def _fill_formula_values(path, lookups):
+    """Запись значений в ячейки формул без значений в XML листов книги.
+
+    lookups[i] — функция (колонка, строка) -> значение для листа
+    sheet{i+1}.xml или None, если лист не меняется. XML листа читается и
+    переписывается блоками, книга заменяется целиком после записи.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as output:
+        for item in source.infolist():
+            match = SHEET_PART.fullmatch(item.filename)
+            index = int(match.group(1)) - 1 if match else None
+            lookup = lookups[index] if index is not None and index < len(lookups) else None
+            if lookup is None:
+                output.writestr(item, source.read(item))
+                continue
+            with source.open(item) as xml_source, output.open(item.filename, 'w', force_zip64=True) as target:
+                _copy_formula_values(xml_source, target, lookup)
+    os.replace(tmp_path, path)
+
+
+def _copy_formula_values(source, target, lookup):
+    def fill(match):
+        value = lookup(column_index_from_string(match.group(2).decode()), int(match.group(3)))
+        if value is None:
+            return match.group(0)
+        return match.group(1) + f"<v>{_plain(float(value))!r}</v>".encode()
+
+    buffer = b""
+    while True:
+        block = source.read(READ_BLOCK_SIZE)
+        buffer += block
+        # обрабатываются только целые ячейки, хвост ждет следующего блока
+        end = len(buffer) if not block else buffer.rfind(b"</c>") + len(b"</c>")
+        if end >= len(b"</c>"):
+            target.write(EMPTY_FORMULA_VALUE.sub(fill, buffer[:end]))
+            buffer = buffer[end:]
+        if not block:
+            target.write(buffer)
+            return
+
+
+def _sheet_plan_fact(ws, register_count, first_row):
+    """План и факт уже записанных строк листа 4..first_row-1 (матрицы даты × кассы)"""
+    rows = max(0, first_row - 4)
+    plan, fact = np.zeros((rows, register_count)), np.zeros((rows, register_count))
+    for row_index, row in enumerate(ws.iter_rows(min_row=4, max_row=first_row - 1, values_only=True)):
+        for register_index in range(register_count):
+            col_offset = register_index * len(HEADERS)
+            plan[row_index, register_index] = _number(row[col_offset + 2] if col_offset + 2 < len(row) else None)
+            fact[row_index, register_index] = _number(row[col_offset + 3] if col_offset + 3 < len(row) else None)
+    return plan, fact
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) else 0.0
+
+
+def _set_calculation(wb, formulas):
+    """С сохраненными значениями формул Excel не пересчитывает всю книгу при открытии"""
+    if formulas == 'cached':
+        wb.calculation.fullCalcOnLoad = False
+
+
+def build_report_info(bases, start_date, end_date, selected_sheets, cash_registers, failed_bases=()):
+    """Сведения об отчете, сохраняемые в свойствах книги.
+
+    failed_bases — базы, данные которых не загрузились: такой отчет не
+    дополняется, а формируется заново.
+    """
+    return {
+        'bases': list(bases),
+        'failed_bases': [base for base in bases if base in set(failed_bases)],
+        'start': _iso_date(start_date),
+        'end': _iso_date(end_date),
+        'sheets': sorted(selected_sheets),
+        'stores': [str(name) for name in cash_registers],
+        'generated': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def read_report_info(path):
+    """Сведения об отчете из свойств книги или None для чужих и старых файлов.
+
+    Читается только docProps/custom.xml, без разбора книги: так можно
+    быстро перебрать все .xlsx папки.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            root = ElementTree.fromstring(archive.read(CUSTOM_PROPS_PART))
+        for prop in root.findall('p:property', CUSTOM_PROPS_NS):
+            if prop.get('name') == REPORT_INFO_PROPERTY:
+                return json.loads(prop.find('vt:lpwstr', CUSTOM_PROPS_NS).text)
+    except Exception:
+        pass
+    return None
+
+
+def _set_report_info(wb, report_info):
+    if REPORT_INFO_PROPERTY in wb.custom_doc_props.names:
+        del wb.custom_doc_props[REPORT_INFO_PROPERTY]
+    wb.custom_doc_props.append(StringProperty(name=REPORT_INFO_PROPERTY, value=json.dumps(report_info, ensure_ascii=False)))
+
+
+def _iso_date(value):
+    return as_date(value).isoformat() if value is not None else None
+
+
+def _numeric(frame, field):
+    """Числовая колонка кадра (0 для пропусков и отсутствующей колонки)"""
+    if field not in frame.columns:
+        return pd.Series(0, index=frame.index)
+    return pd.to_numeric(frame[field], errors='coerce').fillna(0)
+
+
+def _round2(series):
+    # round() Python, а не numpy: значения совпадают с прежним построчным расчетом
+    return series.fillna(0).map(lambda value: round(value, 2))
+
+
+def _to_rows(matrix):
+    """Матрица numpy в список строк из значений Python"""
+    return [[_plain(value) for value in row] for row in matrix.tolist()]
+
+
+def _plain(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
@@ -0,0 +1,98 @@
+# report_job.py — прогресс и отмена выгрузки отчета
+
+import threading
+import time
+
+
+class JobCancelled(Exception):
+    """Выгрузка отменена пользователем"""
+
+
+class ReportJob:
+    """Состояние одной выгрузки: единицы работы (базы, части периода, листы),
+    скачанные байты, оценка оставшегося времени и кооперативная отмена.
+
+    Рабочие потоки отмечают выполненную работу, интерфейс периодически
+    читает snapshot(). cancel() закрывает HTTP-ответы, которые сейчас
+    скачиваются, и разрывает соединения запросов, ждущих ответа сервера,
+    поэтому запросы прерываются, не дожидаясь сервера.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._responses = set()
+        self.started = time.monotonic()
+        self.total_units = 0
+        self.done_units = 0
+        self.bytes_downloaded = 0
+        self.stage = ""
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check(self):
+        """Прерывание работы, если выгрузку отменили"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def wait(self, seconds):
+        """Пауза, прерываемая отменой выгрузки"""
+        if self._cancel_event.wait(seconds):
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel_event.set()
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def add_units(self, count):
+        with self._lock:
+            self.total_units += count
+
+    def complete_unit(self, count=1):
+        with self._lock:
+            self.done_units += count
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes_downloaded += count
+
+    def set_stage(self, stage):
+        self.stage = stage
+
+    def track(self, response):
+        """Регистрация скачиваемого ответа или соединения (объекта с close());
+        при уже отмененной выгрузке он сразу закрывается"""
+        with self._lock:
+            self._responses.add(response)
+        if self.cancelled:
+            response.close()
+
+    def untrack(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def snapshot(self):
+        """Текущее состояние: выполнено/всего, байты, прошедшее время и ETA в секундах"""
+        with self._lock:
+            done, total, downloaded = self.done_units, self.total_units, self.bytes_downloaded
+        elapsed = time.monotonic() - self.started
+        eta = None
+        if 0 < done < total:
+            eta = elapsed / done * (total - done)
+        return {
+            'done': done,
+            'total': total,
+            'remaining': max(total - done, 0),
+            'bytes': downloaded,
+            'elapsed': elapsed,
+            'eta': eta,
+            'stage': self.stage,
+        }
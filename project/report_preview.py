@@ -0,0 +1,226 @@
+# report_preview.py — просмотр матрицы план-факт в окне программы без записи книги Excel
+
+import tkinter as tk
+from tkinter import ttk
+from report_generator import REPORT_SHEETS, plan_fact_aggregates, total_is_sum
+
+ALL_STORES = "Все кассы"
+ROW_HEIGHT = 20      # высота строки Treeview по умолчанию, если тема ее не задает
+HEADER_HEIGHT = 25   # высота строки заголовков
+WHEEL_ROWS = 3       # строк на один шаг колесика мыши
+COLUMN_WIDTH = 110
+
+
+class PreviewTable:
+    """Матрица листа для просмотра: строки дат и строка ИТОГО.
+
+    Значения хранятся массивами (даты × кассы), в текст переводятся только
+    запрошенные строки — таблица на тысячи дат и десятки касс не
+    форматируется целиком. Процент и ИТОГО считаются так же, как формулы
+    листа (plan_fact_aggregates).
+    """
+
+    def __init__(self, stores, day_of_week, dates, plan, fact, sum_total):
+        self.stores = list(stores)
+        self.day_of_week = day_of_week
+        self.dates = dates
+        self.plan = plan
+        self.fact = fact
+        self.percent, self.plan_total, self.fact_total, self.percent_total = \
+            plan_fact_aggregates(plan, fact, sum_total)
+
+    @property
+    def columns(self):
+        columns = ["День недели", "Дата"]
+        for store in self.stores:
+            columns += [f"{store}: план", f"{store}: факт", f"{store}: %"]
+        return columns
+
+    def __len__(self):
+        return len(self.dates) + 1
+
+    def row(self, index):
+        """Значения строки index для показа; последняя строка — ИТОГО"""
+        if index == len(self.dates):
+            values = ["ИТОГО", ""]
+            plan, fact, percent = self.plan_total, self.fact_total, self.percent_total
+        else:
+            day = self.day_of_week[index]
+            values = ["" if day is None else str(day), self.dates[index]]
+            plan, fact, percent = self.plan[index], self.fact[index], self.percent[index]
+        for store_index in range(len(self.stores)):
+            values += [_format_number(plan[store_index]), _format_number(fact[store_index]),
+                       f"{percent[store_index]:.1%}"]
+        return values
+
+
+def build_preview_table(metrics, cash_registers, sheet_key, stores=None):
+    """PreviewTable листа sheet_key (ключ REPORT_SHEETS) по таблице метрик.
+
+    stores — кассы для показа (по умолчанию все, в порядке колонок отчета).
+    """
+    sheet_title, _, metric = REPORT_SHEETS[sheet_key]
+    register_count = len(cash_registers)
+    positions = {store: index for index, store in enumerate(cash_registers)}
+    stores = list(cash_registers) if not stores else [store for store in stores if store in positions]
+    columns = [positions[store] for store in stores]
+    plan = metrics[f'Plan.{metric}'].to_numpy(dtype=float).reshape(-1, register_count)[:, columns]
+    fact = metrics[f'Fact.{metric}'].to_numpy(dtype=float).reshape(-1, register_count)[:, columns]
+    day_of_week = metrics['DayOfWeekOpen'].iloc[::register_count].tolist()
+    dates = metrics['Date'].iloc[::register_count].tolist()
+    return PreviewTable(stores, day_of_week, dates, plan, fact, total_is_sum(sheet_title))
+
+
+class VirtualGrid(ttk.Frame):
+    """Таблица на ttk.Treeview, в которой есть только видимые строки.
+
+    Treeview держит столько элементов, сколько строк помещается в окне; при
+    прокрутке (полоса, колесико, клавиши) меняются только их значения,
+    поэтому показ и прокрутка не зависят от числа строк таблицы.
+    """
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.table = None
+        self.offset = 0
+        self.visible = 1
+        self.row_height = int(ttk.Style().lookup("Treeview", "rowheight") or ROW_HEIGHT)
+
+        self.tree = ttk.Treeview(self, show='headings', selectmode='none')
+        self.vbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        hbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=hbar.set)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.vbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        hbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-WHEEL_ROWS))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(WHEEL_ROWS))
+        self.tree.bind('<Prior>', lambda event: self.scroll(-self.visible))
+        self.tree.bind('<Next>', lambda event: self.scroll(self.visible))
+        self.tree.bind('<Up>', lambda event: self.scroll(-1))
+        self.tree.bind('<Down>', lambda event: self.scroll(1))
+        self.tree.bind('<Home>', lambda event: self.scroll_to(0))
+        self.tree.bind('<End>', lambda event: self.scroll_to(len(self.table or ())))
+
+    def set_table(self, table, keep_position=False):
+        """Показ новой таблицы (другой лист или набор касс)"""
+        self.table = table
+        self.tree.delete(*self.tree.get_children())
+        self.tree['columns'] = [f"c{index}" for index in range(len(table.columns))]
+        for index, title in enumerate(table.columns):
+            anchor = tk.W if index < 2 else tk.E
+            self.tree.heading(f"c{index}", text=title, anchor=anchor)
+            self.tree.column(f"c{index}", width=COLUMN_WIDTH, minwidth=60, anchor=anchor, stretch=False)
+        if not keep_position:
+            self.offset = 0
+        self.render()
+
+    def on_resize(self, event):
+        visible = max(1, (event.height - HEADER_HEIGHT) // self.row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(amount) * len(self.table or ())))
+        elif action == 'scroll':
+            self.scroll(int(amount) * (self.visible if unit == 'pages' else 1))
+
+    def scroll(self, rows):
+        self.scroll_to(self.offset + rows)
+        return "break"
+
+    def scroll_to(self, offset):
+        if self.table is None:
+            return "break"
+        offset = max(0, min(offset, len(self.table) - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+        return "break"
+
+    def render(self):
+        """Заполнение видимых строк значениями с позиции offset"""
+        if self.table is None:
+            return
+        total = len(self.table)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        count = min(self.visible, total - self.offset)
+        items = list(self.tree.get_children())
+        for item in items[count:]:
+            self.tree.delete(item)
+        for index in range(count):
+            values = self.table.row(self.offset + index)
+            if index < len(items):
+                self.tree.item(items[index], values=values)
+            else:
+                self.tree.insert('', tk.END, values=values)
+        if total:
+            self.vbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.vbar.set(0, 1)
+
+
+class PreviewWindow(tk.Toplevel):
+    """Окно предпросмотра: выбор листа и кассы, таблица и сохранение в Excel.
+
+    metrics и cash_registers — готовая таблица метрик отчета; смена листа
+    или кассы только перестраивает PreviewTable, данные не загружаются
+    заново. on_export(metrics, cash_registers) вызывается по кнопке
+    сохранения.
+    """
+
+    def __init__(self, master, metrics, cash_registers, selected_sheets, title, on_export):
+        super().__init__(master)
+        self.title(title)
+        self.geometry("1000x600")
+        self.metrics = metrics
+        self.cash_registers = cash_registers
+        self.on_export = on_export
+        self.sheet_keys = {REPORT_SHEETS[key][0]: key for key in selected_sheets}
+
+        controls = ttk.Frame(self, padding="10")
+        controls.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        ttk.Label(controls, text="Лист:").grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
+        self.sheet_var = tk.StringVar(value=next(iter(self.sheet_keys)))
+        sheet_combo = ttk.Combobox(controls, textvariable=self.sheet_var, values=list(self.sheet_keys),
+                                   state='readonly', width=28)
+        sheet_combo.grid(row=0, column=1, sticky=tk.W, padx=(0, 10))
+        ttk.Label(controls, text="Касса:").grid(row=0, column=2, sticky=tk.W, padx=(0, 5))
+        self.store_var = tk.StringVar(value=ALL_STORES)
+        store_combo = ttk.Combobox(controls, textvariable=self.store_var,
+                                   values=[ALL_STORES] + list(cash_registers), state='readonly', width=28)
+        store_combo.grid(row=0, column=3, sticky=tk.W, padx=(0, 10))
+        ttk.Button(controls, text="Сохранить в Excel", command=self.export).grid(row=0, column=4, sticky=tk.E)
+        controls.columnconfigure(4, weight=1)
+
+        self.grid_view = VirtualGrid(self)
+        self.grid_view.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=(0, 10))
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        sheet_combo.bind('<<ComboboxSelected>>', lambda event: self.show(keep_position=True))
+        store_combo.bind('<<ComboboxSelected>>', lambda event: self.show(keep_position=True))
+        self.show()
+
+    def show(self, keep_position=False):
+        store = self.store_var.get()
+        stores = None if store == ALL_STORES else [store]
+        table = build_preview_table(self.metrics, self.cash_registers, self.sheet_keys[self.sheet_var.get()], stores)
+        self.grid_view.set_table(table, keep_position)
+
+    def export(self):
+        self.on_export(self.metrics, self.cash_registers)
+
+
+def _format_number(value):
+    """Число с пробелами между разрядами; дробная часть — только если она есть"""
+    if float(value).is_integer():
+        return f"{value:,.0f}".replace(",", " ")
+    return f"{value:,.2f}".replace(",", " ")
@@ -0,0 +1,104 @@
+# resilience.py — повторы с экспоненциальной задержкой и ограничение частоты запросов к серверу
+
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+RETRY_ATTEMPTS = 4                      # попыток на один запрос, включая первую
+RETRY_BASE_DELAY = 1.0                  # секунд перед первым повтором
+RETRY_MAX_DELAY = 30.0                  # предел задержки между попытками
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+HOST_RATE = 5.0                         # запросов в секунду к одному серверу
+HOST_BURST = 10                         # запросов подряд без ожидания
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class IikoRequestError(Exception):
+    """Запрос к серверу iiko не удался после всех попыток"""
+
+    def __init__(self, message, status=None, attempts=0):
+        super().__init__(message)
+        self.status = status
+        self.attempts = attempts
+
+
+class RequestStats:
+    """Счетчик попыток запросов одной базы (части периода грузятся параллельно)"""
+
+    def __init__(self):
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def add_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+
+class RetryPolicy:
+    """Сколько раз и с какой задержкой повторять запрос.
+
+    Задержка растет как base_delay * 2^(попытка-1) до max_delay, из этого
+    интервала берется случайное значение (full jitter), чтобы параллельные
+    запросы к одному серверу не повторялись одновременно.
+    """
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, retry_statuses=RETRY_STATUSES):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+    def is_retryable_status(self, status):
+        return status in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Пауза после неудачной попытки номер attempt (с 1)"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """Ограничение частоты: не больше rate запросов в секунду, burst подряд"""
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Занять токен; возвращает, сколько секунд нужно подождать перед запросом"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+def host_bucket(url, rate=HOST_RATE, burst=HOST_BURST):
+    """Общий для процесса ограничитель частоты сервера (по хосту и порту)"""
+    host = urlsplit(url.strip()).netloc
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            _buckets[host] = bucket
+        return bucket
+
+
+def retry_after_seconds(response):
+    """Значение заголовка Retry-After в секундах или None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
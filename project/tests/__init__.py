@@ -0,0 +1,2 @@
+# tests — проверки на локальном сервере-имитации iiko (запуск из папки project):
+#   python -m unittest discover -s tests -t .
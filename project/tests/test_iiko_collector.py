@@ -0,0 +1,170 @@
+# test_iiko_collector.py — повторы запросов к iiko: /auth и перезапрос токена после 401/403
+
+import json
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from iiko_collector import IikoDataCollector
+from olap_cache import OlapCache
+from report_job import JobCancelled, ReportJob
+from resilience import IikoRequestError, RequestStats, RetryPolicy
+
+DAY = date(2024, 1, 1)
+
+
+class ScriptedServer:
+    """Сервер iiko с заданными по порядку статусами ответов.
+
+    auth и olap — списки статусов для /auth и запросов отчетов; когда
+    список кончается, отвечается 200, а None — не отвечать до остановки
+    сервера. Токен — номер успешной авторизации. На запрос отчета со
+    статусом 200 отдаются строки rows; запрошенные пути пишутся в paths.
+    """
+
+    def __init__(self, auth=(), olap=(), rows=()):
+        self.auth = list(auth)
+        self.olap = list(olap)
+        self.body = json.dumps({'data': list(rows)}).encode()
+        self.paths = []
+        self.requests = {'auth': 0, 'olap': 0, 'logout': 0}
+        self.tokens = 0
+        self.stopped = threading.Event()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests['auth'] += 1
+                status = server.auth.pop(0) if server.auth else 200
+                if status is None:
+                    server.stopped.wait()
+                    return
+                if status != 200:
+                    return self.reply(status)
+                server.tokens += 1
+                self.reply(200, f"token-{server.tokens}".encode())
+
+            def do_GET(self):
+                if self.path.startswith("/logout"):
+                    server.requests['logout'] += 1
+                    return self.reply(200)
+                server.requests['olap'] += 1
+                server.paths.append(self.path)
+                status = server.olap.pop(0) if server.olap else 200
+                self.reply(status, server.body if status == 200 else b"")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class AuthRetryTest(unittest.TestCase):
+    def collector(self, attempts=3, **statuses):
+        server = ScriptedServer(**statuses).start()
+        self.addCleanup(server.stop)
+        collector = IikoDataCollector(server.url, retry_policy=RetryPolicy(attempts=attempts, base_delay=0.01))
+        return server, collector
+
+    def test_auth_is_retried_after_server_error(self):
+        server, collector = self.collector(auth=[503])
+        stats = RequestStats()
+        self.assertEqual(collector.get_report_data("p", DAY, DAY, stats=stats), {'data': []})
+        self.assertEqual(server.requests['auth'], 2)
+        self.assertEqual(stats.attempts, 3)
+
+    def test_last_auth_error_is_raised(self):
+        server, collector = self.collector(auth=[503, 503, 503])
+        with self.assertRaises(IikoRequestError) as raised:
+            collector.get_report_data("p", DAY, DAY)
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(raised.exception.attempts, 3)
+        self.assertEqual(server.requests['olap'], 0)
+
+    def test_wrong_password_is_not_retried(self):
+        server, collector = self.collector(auth=[401])
+        with self.assertRaises(IikoRequestError) as raised:
+            collector.get_report_data("p", DAY, DAY)
+        self.assertEqual(raised.exception.status, 401)
+        self.assertEqual(server.requests['auth'], 1)
+
+
+class ReauthTest(unittest.TestCase):
+    def test_expired_token_with_single_attempt(self):
+        server = ScriptedServer(olap=[401]).start()
+        self.addCleanup(server.stop)
+        collector = IikoDataCollector(server.url, retry_policy=RetryPolicy(attempts=1))
+        self.assertEqual(collector.get_report_data("p", DAY, DAY), {'data': []})
+        self.assertEqual(server.requests['auth'], 2)
+        self.assertEqual(server.requests['olap'], 2)
+
+    def test_token_is_renewed_only_once(self):
+        server = ScriptedServer(olap=[401, 401]).start()
+        self.addCleanup(server.stop)
+        collector = IikoDataCollector(server.url, retry_policy=RetryPolicy(attempts=1))
+        with self.assertRaises(IikoRequestError) as raised:
+            collector.get_report_data("p", DAY, DAY)
+        self.assertEqual(raised.exception.status, 401)
+        self.assertEqual(server.requests['olap'], 2)
+
+
+class CancelAuthTest(unittest.TestCase):
+    def test_cancel_interrupts_hanging_auth(self):
+        server = ScriptedServer(auth=[None]).start()
+        self.addCleanup(server.stop)
+        collector = IikoDataCollector(server.url, timeout=30, retry_policy=RetryPolicy(attempts=1))
+        job = ReportJob()
+        threading.Timer(0.3, job.cancel).start()
+        started = time.monotonic()
+        with self.assertRaises(JobCancelled):
+            collector.get_report_data("p", DAY, DAY, job=job)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(server.requests['olap'], 0)
+
+
+class UndatedRowsTest(unittest.TestCase):
+    def test_undated_rows_are_fetched_by_chunks_up_to_today(self):
+        server = ScriptedServer(rows=[{'Store.Name': "Касса", 'DishSumInt': 100}]).start()
+        self.addCleanup(server.stop)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        collector = IikoDataCollector(server.url, cache=OlapCache(cache_dir.name), chunk_days=3)
+        today = date.today()
+        data = collector.get_report_data("p", today - timedelta(days=6), today + timedelta(days=5))
+
+        # первый проход частями по 3 дня, затем повтор без кэша теми же частями
+        self.assertEqual(server.requests['olap'], 6)
+        self.assertEqual(len(data['data']), 3)
+        date_to = (today + timedelta(days=1)).isoformat()
+        self.assertTrue(all("dateTo=" in path for path in server.paths))
+        self.assertTrue(all(path.split("dateTo=")[1][:10] <= date_to for path in server.paths))
+
+
+if __name__ == "__main__":
+    unittest.main()
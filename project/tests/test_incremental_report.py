@@ -0,0 +1,127 @@
+# test_incremental_report.py — дополнение отчета: какие отчеты подходят и с какого дня их обновлять
+
+import socket
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from openpyxl import Workbook
+from data_fetcher import fetch_bases
+from iiko_collector import get_collector
+from incremental_report import find_previous_report, refresh_report, refresh_start
+from mock_iiko_server import MockIikoServer
+from report_generator import ReportGenerator, build_report_info
+from resilience import RetryPolicy
+
+START = date(2024, 1, 1)
+END = date(2024, 1, 10)
+SHEETS = [1, 4]
+
+
+def closed_port_url():
+    """Адрес, на котором никто не слушает: база с таким url не загружается"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+class PartialReportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockIikoServer(2, name="Б1").start()
+        self.addCleanup(self.server.stop)
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = Path(work_dir.name)
+        dead_url = closed_port_url()
+        get_collector(dead_url, cache=None, retry_policy=RetryPolicy(attempts=1))
+        self.bases_config = {
+            "Б1": {"url": self.server.url, "preset_id": "p"},
+            "Б2": {"url": dead_url, "preset_id": "p"},
+        }
+        self.log = []
+
+    def write_report(self, name):
+        """Отчет по обеим базам так же, как его пишет cli.py"""
+        results = []
+        olap_data = fetch_bases(self.bases_config, list(self.bases_config), START, END, log=self.log.append,
+                                cache=None, retry_rounds=0, results=results)
+        failed_bases = [result.base_name for result in results if result.failed]
+        generator = ReportGenerator(log_callback=self.log.append, processes=1)
+        metrics, cash_registers = generator.prepare_report_data(olap_data)
+        path = self.work_dir / name
+        info = build_report_info(list(self.bases_config), START, END, SHEETS, cash_registers, failed_bases)
+        self.assertTrue(generator.write_excel_report(metrics, cash_registers, path, SHEETS, info))
+        return path, failed_bases
+
+    def test_report_with_failed_base_is_rebuilt(self):
+        path, failed_bases = self.write_report("Свод_План_Факт_partial.xlsx")
+        self.assertEqual(failed_bases, ["Б2"])
+
+        self.assertEqual(find_previous_report(self.work_dir, list(self.bases_config), START, END, SHEETS),
+                         (None, None))
+        olap_requests = self.server.requests['olap']
+        self.assertIsNone(refresh_report(self.bases_config, list(self.bases_config), START, END, SHEETS,
+                                         self.work_dir, log=self.log.append, cache=None))
+        # отчет не дополнялся: новых запросов нет, следующий запуск сформирует его заново
+        self.assertEqual(self.server.requests['olap'], olap_requests)
+
+    def test_complete_report_is_found(self):
+        self.bases_config["Б2"] = {"url": self.server.url, "preset_id": "p"}
+        path, failed_bases = self.write_report("Свод_План_Факт_full.xlsx")
+        self.assertEqual(failed_bases, [])
+        found, info = find_previous_report(self.work_dir, list(self.bases_config), START, END, SHEETS)
+        self.assertEqual(found, path)
+        self.assertEqual(info['failed_bases'], [])
+
+
+class RefreshStartTest(unittest.TestCase):
+    """С какого дня дополняется отчет: дни, закрытые после его формирования, перезагружаются"""
+
+    def test_after_midnight_report_refreshes_previous_day(self):
+        # в 00:30 предыдущий день еще не закрыт (CLOSED_DAY_DELAY)
+        self.assertEqual(refresh_start({'generated': "2024-01-10T00:30:00"}, START), date(2024, 1, 9))
+
+    def test_report_after_closing_keeps_previous_day(self):
+        self.assertEqual(refresh_start({'generated': "2024-01-10T05:00:00"}, START), date(2024, 1, 10))
+
+    def test_old_report_with_date_only(self):
+        self.assertEqual(refresh_start({'generated': "2024-01-10"}, START), date(2024, 1, 9))
+
+    def test_not_before_period_start(self):
+        self.assertEqual(refresh_start({'generated': "2024-01-10T05:00:00"}, date(2024, 1, 20)), date(2024, 1, 20))
+
+
+class ReportLookupTest(unittest.TestCase):
+    """Отчет находится по свойству iiko_report, а не по имени файла"""
+
+    def setUp(self):
+        self.server = MockIikoServer(2, name="Б1").start()
+        self.addCleanup(self.server.stop)
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = Path(work_dir.name)
+        self.bases_config = {"Б1": {"url": self.server.url, "preset_id": "p"}}
+        self.log = []
+        olap_data = fetch_bases(self.bases_config, ["Б1"], START, END, log=self.log.append, cache=None)
+        generator = ReportGenerator(log_callback=self.log.append, processes=1)
+        metrics, cash_registers = generator.prepare_report_data(olap_data)
+        self.path = self.work_dir / "daily.xlsx"
+        generator.write_excel_report(metrics, cash_registers, self.path, SHEETS,
+                                     build_report_info(["Б1"], START, END, SHEETS, cash_registers))
+        Workbook().save(self.work_dir / "чужая книга.xlsx")
+
+    def test_found_by_property(self):
+        found, info = find_previous_report(self.work_dir, ["Б1"], START, END, SHEETS)
+        self.assertEqual(found, self.path)
+        self.assertEqual(info['bases'], ["Б1"])
+
+    def test_explicit_report_path(self):
+        self.assertEqual(find_previous_report(self.work_dir, ["Б1"], START, END, SHEETS, self.path)[0], self.path)
+        other = self.work_dir / "другой.xlsx"
+        self.assertEqual(find_previous_report(self.work_dir, ["Б1"], START, END, SHEETS, other), (None, None))
+        self.assertEqual(refresh_report(self.bases_config, ["Б1"], START, END, SHEETS, self.work_dir,
+                                        log=self.log.append, report_path=self.path, cache=None), self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# test_olap_stream.py — потоковый разбор ответа OLAP: тот же результат, что у json.loads, при любой нарезке
+
+import json
+import unittest
+from olap_stream import OlapParseError, OlapStreamParser
+
+ROWS = [
+    {"Store.Name": "Касса «Центр»", "OpenDate.Typed": "2024-01-01", "DishSumInt": 1250.5, "GuestNum": 12},
+    {"Store.Name": "Кавычка \" и слэш \\ и }],{", "OpenDate.Typed": "2024-01-02", "DishSumInt": -3e-2,
+     "GuestNum": 0},
+    {"Store.Name": "Эмодзи 😀 и таб\t", "OpenDate.Typed": None, "DishSumInt": 1E+3,
+     "Flags": [True, False, None], "Nested": {"}": "]"}},
+]
+BODY = json.dumps({"summary": {"rows": 3}, "data": ROWS, "count": 125}, ensure_ascii=False).encode()
+ESCAPED_BODY = json.dumps({"data": ROWS, "note": "\\\"}"}, ensure_ascii=True).encode()
+
+
+def parse(chunks):
+    parser = OlapStreamParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+class OlapStreamParserTest(unittest.TestCase):
+    def test_matches_json_loads_at_every_split(self):
+        # граница порции внутри строки, escape-последовательности, числа и многобайтового символа
+        for body in (BODY, ESCAPED_BODY):
+            expected = json.loads(body)
+            for split in range(len(body) + 1):
+                with self.subTest(body=body[:20], split=split):
+                    self.assertEqual(parse([body[:split], body[split:]]), expected)
+
+    def test_matches_json_loads_byte_by_byte(self):
+        for body in (BODY, ESCAPED_BODY):
+            self.assertEqual(parse(body[index:index + 1] for index in range(len(body))), json.loads(body))
+
+    def test_whitespace_and_empty_data(self):
+        body = b' \n{ "data" : [ ] ,\r\n "count" : 0 }\t'
+        self.assertEqual(parse([body]), json.loads(body))
+
+    def test_truncated_body_raises(self):
+        for end in range(len(BODY)):
+            with self.subTest(end=end):
+                with self.assertRaises(OlapParseError):
+                    parse([BODY[:end]])
+
+    def test_invalid_body_raises(self):
+        for body in (b'[{"data": []}]', b'{"data" []}', b'{"data": [{"a": }]}', b'{"data": []} tail',
+                     b'{"data": ["\xff"]}'):
+            with self.subTest(body=body):
+                with self.assertRaises(OlapParseError):
+                    parse([body])
+
+
+if __name__ == "__main__":
+    unittest.main()
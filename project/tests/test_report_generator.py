@@ -0,0 +1,117 @@
+# test_report_generator.py — запись отчетов: значения формул (formulas='cached') и пул процессов
+
+import io
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest import mock
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+import report_generator
+from data_fetcher import fetch_bases
+from mock_iiko_server import MockIikoServer
+from report_generator import HEADERS, REPORT_SHEETS, ReportGenerator, _copy_formula_values
+
+START = date(2024, 1, 1)
+END = date(2024, 1, 10)
+SHEETS = sorted(REPORT_SHEETS)
+
+
+class ReportDataTest(unittest.TestCase):
+    """Таблица метрик по данным имитации iiko и временная папка для отчетов"""
+
+    @classmethod
+    def setUpClass(cls):
+        with MockIikoServer(3, name="Б1") as server:
+            olap_data = fetch_bases({"Б1": {"url": server.url, "preset_id": "p"}}, ["Б1"], START, END,
+                                    log=lambda message: None, cache=None)
+        cls.generator = ReportGenerator(log_callback=lambda message: None)
+        cls.metrics, cls.cash_registers = cls.generator.prepare_report_data(olap_data)
+
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = Path(work_dir.name)
+
+
+class CachedFormulaValuesTest(ReportDataTest):
+    def write_report(self, streaming, processes):
+        generator = ReportGenerator(log_callback=lambda message: None, streaming=streaming, processes=processes,
+                                    formulas='cached')
+        path = self.work_dir / f"cached_{streaming}_{processes}.xlsx"
+        self.assertTrue(generator.write_excel_report(self.metrics, self.cash_registers, path, SHEETS))
+        return path
+
+    def assert_values_match_aggregates(self, path):
+        values = load_workbook(path, data_only=True)
+        formulas = load_workbook(path)
+        register_count = len(self.cash_registers)
+        days = len(self.metrics) // register_count
+        total_row = 4 + days
+        for key in SHEETS:
+            sheet_title, _, metric = REPORT_SHEETS[key]
+            ws = values[sheet_title]
+            percent, plan_total, fact_total, percent_total = self.generator.sheet_aggregates(
+                self.metrics, self.cash_registers, sheet_title, metric)
+
+            # строки листа и объединенные заголовки не задеты
+            self.assertEqual(ws["A1"].value, sheet_title.upper())
+            self.assertEqual(ws.cell(row=total_row, column=1).value, "ИТОГО")
+            self.assertIn("A1:E1", {str(cell_range) for cell_range in formulas[sheet_title].merged_cells.ranges})
+            for register_index, cash_register in enumerate(self.cash_registers):
+                col = register_index * len(HEADERS) + 1
+                self.assertEqual(ws.cell(row=2, column=col).value, cash_register)
+                self.assertEqual([ws.cell(row=3, column=col + offset).value for offset in range(len(HEADERS))],
+                                 HEADERS)
+
+                plan_col, fact_col, percent_col = col + 2, col + 3, col + 4
+                for day in range(days):
+                    self.assertAlmostEqual(ws.cell(row=4 + day, column=percent_col).value,
+                                           percent[day][register_index], places=9)
+                self.assertAlmostEqual(ws.cell(row=total_row, column=plan_col).value, plan_total[register_index],
+                                       places=9)
+                self.assertAlmostEqual(ws.cell(row=total_row, column=fact_col).value, fact_total[register_index],
+                                       places=9)
+                self.assertAlmostEqual(ws.cell(row=total_row, column=percent_col).value,
+                                       percent_total[register_index], places=9)
+                # формулы остаются формулами
+                self.assertTrue(str(formulas[sheet_title][f"{get_column_letter(percent_col)}{total_row}"].value)
+                                .startswith("=IF("))
+
+    def test_in_process(self):
+        for streaming in (False, True):
+            with self.subTest(streaming=streaming):
+                self.assert_values_match_aggregates(self.write_report(streaming, processes=1))
+
+    def test_sheets_in_processes(self):
+        self.assert_values_match_aggregates(self.write_report(True, processes=2))
+
+    def test_shared_strings_are_kept(self):
+        # Excel и другие программы хранят строки в sharedStrings: значения <v> у ячеек с t="s"
+        # и у формул, уже имеющих значение, не меняются даже на границе блоков чтения
+        xml = (b'<sheetData><row r="4"><c r="A4" t="s"><v>0</v></c><c r="B4" t="s"><v></v></c>'
+               b'<c r="E4" s="3"><f>IF(C4=0, 0, D4/C4)</f><v></v></c>'
+               b'<c r="F4"><f>1+1</f><v>2</v></c><c r="G4" t="s"><v>7</v></c>'
+               b'<c r="H4"><f>SUM(C4:D4)</f><v /></c></row></sheetData>')
+        target = io.BytesIO()
+        with mock.patch.object(report_generator, 'READ_BLOCK_SIZE', 16):
+            _copy_formula_values(io.BytesIO(xml), target, lambda column, row: {5: 0.5, 8: 3.0}.get(column))
+        self.assertEqual(target.getvalue(), xml.replace(b'D4/C4)</f><v></v>', b'D4/C4)</f><v>0.5</v>')
+                         .replace(b'SUM(C4:D4)</f><v />', b'SUM(C4:D4)</f><v>3</v>'))
+
+
+class WriteReportsTest(ReportDataTest):
+    def test_small_reports_skip_process_pool(self):
+        generator = ReportGenerator(log_callback=lambda message: None)
+        paths = [self.work_dir / f"report_{index}.xlsx" for index in range(2)]
+        reports = [(self.metrics, self.cash_registers, path, SHEETS, None) for path in paths]
+        with mock.patch.object(report_generator, 'ProcessPoolExecutor') as pool, \
+                mock.patch.object(report_generator.os, 'cpu_count', return_value=4):
+            self.assertEqual(generator.write_excel_reports(reports), 0)
+        pool.assert_not_called()
+        self.assertTrue(all(path.exists() for path in paths))
+
+
+if __name__ == "__main__":
+    unittest.main()